@@ -0,0 +1,175 @@
+from __future__ import annotations
+import argparse
+import os
+import time
+from pathlib import Path
+from typing import Optional, Tuple
+import numpy as np
+
+from .kb_store import BLOCK_ROWS, atomic_write, dot_rows, normalize_query, normalize_rows, topk
+
+# --------------------------
+# Settings
+# --------------------------
+ANN_MIN_ROWS = int(os.getenv("ANN_MIN_ROWS", "100000"))  # below this, brute force is faster
+ANN_NPROBE = int(os.getenv("ANN_NPROBE", "8"))           # lists scanned per query
+
+
+def default_nlist(n_rows: int) -> int:
+    """Rule of thumb: ~sqrt(N) coarse lists."""
+    return max(1, min(n_rows, int(np.sqrt(n_rows))))
+
+
+# --------------------------
+# IVF (inverted file) index
+# --------------------------
+class IVFIndex:
+    """
+    Inverted-file index over unit-normalized rows.
+    Rows are clustered with spherical k-means; a query scores the centroids,
+    then only the rows of the `nprobe` closest lists.
+    """
+
+    def __init__(self, centroids: np.ndarray, offsets: np.ndarray, ids: np.ndarray):
+        self.centroids = np.asarray(centroids, dtype=np.float32)  # (nlist, dim), unit rows
+        self.offsets = np.asarray(offsets, dtype=np.int64)        # (nlist + 1,) into ids
+        self.ids = np.asarray(ids, dtype=np.int64)                # row ids grouped by list
+
+    @property
+    def nlist(self) -> int:
+        return len(self.centroids)
+
+    @property
+    def rows(self) -> int:
+        return len(self.ids)
+
+    @classmethod
+    def build(
+        cls,
+        E: np.ndarray,
+        nlist: Optional[int] = None,
+        iters: int = 10,
+        sample: int = 64,
+        seed: int = 0,
+    ) -> "IVFIndex":
+        """
+        Train centroids on a sample of at most `sample` rows per list,
+        then assign every row of E (blockwise) to its nearest centroid.
+        """
+        n = len(E)
+        nlist = nlist or default_nlist(n)
+        rng = np.random.default_rng(seed)
+
+        train_idx = np.sort(rng.choice(n, size=min(n, nlist * sample), replace=False))
+        X = np.asarray(E[train_idx], dtype=np.float32)
+        C = X[rng.choice(len(X), size=nlist, replace=False)].copy()
+
+        for _ in range(iters):
+            assign = np.argmax(X @ C.T, axis=1)
+            sums = np.zeros_like(C)
+            np.add.at(sums, assign, X)
+            counts = np.bincount(assign, minlength=nlist)
+            # Re-seed empty lists from random training rows
+            empty = counts == 0
+            if empty.any():
+                sums[empty] = X[rng.choice(len(X), size=int(empty.sum()), replace=False)]
+            C = normalize_rows(sums, np.float32)
+
+        assign = np.empty(n, dtype=np.int64)
+        for start in range(0, n, BLOCK_ROWS):
+            assign[start : start + BLOCK_ROWS] = np.argmax(dot_rows(E[start : start + BLOCK_ROWS], C), axis=1)
+        ids = np.argsort(assign, kind="stable")
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(assign, minlength=nlist))])
+        return cls(C, offsets, ids)
+
+    def search(self, E: np.ndarray, query_vec, k: int = 8, nprobe: int = ANN_NPROBE) -> Tuple[np.ndarray, np.ndarray]:
+        """Return (row ids, cosine scores) of the approximate top-k, best first."""
+        q = normalize_query(query_vec)
+        nprobe = max(1, min(nprobe, self.nlist))
+        lists = np.argpartition(-(self.centroids @ q), nprobe - 1)[:nprobe]
+        cand = np.concatenate([self.ids[self.offsets[l] : self.offsets[l + 1]] for l in lists])
+        if len(cand) == 0:
+            return cand, np.empty(0, dtype=np.float32)
+        cand.sort()  # sequential reads from a memory-mapped store
+        top, scores = topk(dot_rows(E[cand], q), k)
+        return cand[top], scores
+
+    def save(self, path: Path) -> Path:
+        """Write the index atomically as .npz."""
+        path = Path(path)
+        with atomic_write(path) as f:
+            np.savez(f, centroids=self.centroids, offsets=self.offsets, ids=self.ids)
+        return path
+
+    @classmethod
+    def load(cls, path: Path) -> "IVFIndex":
+        with np.load(Path(path)) as z:
+            return cls(z["centroids"], z["offsets"], z["ids"])
+
+
+def build_ivf(E: np.ndarray, path: Path, nlist: Optional[int] = None) -> Path:
+    """KB build step: train + save an IVF index for the normalized rows E."""
+    index = IVFIndex.build(E, nlist=nlist)
+    print(f"✅ Built IVF index: {index.rows} rows, {index.nlist} lists")
+    return index.save(path)
+
+
+# --------------------------
+# Benchmark: recall@k vs latency against the exact path
+# --------------------------
+def benchmark(
+    E: Optional[np.ndarray] = None,
+    rows: int = 200000,
+    dim: int = 768,
+    k: int = 8,
+    queries: int = 50,
+    nprobes: Tuple[int, ...] = (1, 2, 4, 8, 16, 32),
+    nlist: Optional[int] = None,
+    seed: int = 0,
+) -> list[dict]:
+    """
+    Compare IVF search with brute force on E (or a synthetic clustered matrix).
+    Prints and returns one row per nprobe: recall@k and mean latency in ms.
+    """
+    rng = np.random.default_rng(seed)
+    if E is None:
+        centers = rng.standard_normal((max(1, rows // 500), dim)).astype(np.float32)
+        E = centers[rng.integers(0, len(centers), rows)] + 0.5 * rng.standard_normal((rows, dim)).astype(np.float32)
+        E = normalize_rows(E, np.float32)
+    Q = E[rng.choice(len(E), size=queries, replace=False)] + 0.1 * rng.standard_normal((queries, E.shape[1])).astype(np.float32)
+
+    t0 = time.perf_counter()
+    index = IVFIndex.build(E, nlist=nlist)
+    print(f"Index build: {index.nlist} lists over {len(E)} rows in {time.perf_counter() - t0:.2f}s")
+
+    t0 = time.perf_counter()
+    truth = [set(topk(dot_rows(E, q), k)[0].tolist()) for q in Q]
+    exact_ms = 1000 * (time.perf_counter() - t0) / queries
+    print(f"{'method':>12} {'recall@' + str(k):>10} {'ms/query':>10}")
+    print(f"{'exact':>12} {1.0:>10.3f} {exact_ms:>10.2f}")
+
+    results = [{"method": "exact", "nprobe": None, "recall": 1.0, "ms": exact_ms}]
+    for nprobe in nprobes:
+        hits = 0
+        t0 = time.perf_counter()
+        for q, gold in zip(Q, truth):
+            ids, _ = index.search(E, q, k=k, nprobe=nprobe)
+            hits += len(gold.intersection(ids.tolist()))
+        ms = 1000 * (time.perf_counter() - t0) / queries
+        recall = hits / (k * queries)
+        print(f"{'ivf/' + str(nprobe):>12} {recall:>10.3f} {ms:>10.2f}")
+        results.append({"method": "ivf", "nprobe": nprobe, "recall": recall, "ms": ms})
+    return results
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="IVF recall@k vs latency benchmark")
+    ap.add_argument("--vectors", type=Path, help="normalized .npy store (default: synthetic data)")
+    ap.add_argument("--rows", type=int, default=200000)
+    ap.add_argument("--dim", type=int, default=768)
+    ap.add_argument("--k", type=int, default=8)
+    ap.add_argument("--queries", type=int, default=50)
+    ap.add_argument("--nlist", type=int)
+    args = ap.parse_args()
+    E = np.load(args.vectors, mmap_mode="r") if args.vectors else None
+    benchmark(E, rows=args.rows, dim=args.dim, k=args.k, queries=args.queries, nlist=args.nlist)
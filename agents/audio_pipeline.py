@@ -0,0 +1,166 @@
+from __future__ import annotations
+import os
+import re
+import tempfile
+from pathlib import Path
+from typing import Callable, List, Optional, Tuple
+
+from .gemini_client import agen_text, aupload_file, submit_async
+from .media_prep import AudioDecodeError, export_speech, report_savings
+
+# --------------------------
+# Settings
+# --------------------------
+SEGMENT_MAX_S = float(os.getenv("AUDIO_SEGMENT_MAX_S", "600"))  # upper bound per segment
+SILENCE_SEARCH_S = 60.0      # look for a pause in the last minute before each cut...
+SILENCE_SEARCH_FRAC = 0.25   # ...but never in more than the last quarter of the segment
+MIN_SILENCE_MS = 700         # pause length that counts as a cut point
+SILENCE_DB_BELOW = 16        # silence threshold: this many dB under the average loudness
+SEGMENT_RETRIES = int(os.getenv("AUDIO_SEGMENT_RETRIES", "2"))
+
+SEGMENT_PROMPT = (
+    "Transcribe this audio clip. Use readable punctuation, minimal fillers.\n"
+    "Insert a [mm:ss] timestamp about every 60 seconds, measured from the start of this clip.\n"
+    "If speakers are discernible, label them Speaker 1, Speaker 2, ...\n"
+    "Return ONLY the cleaned transcript text."
+)
+
+TIMESTAMP = re.compile(r"\[(?:(\d{1,2}):)?(\d{1,3}):(\d{2})\]")
+
+
+# --------------------------
+# Segmentation
+# --------------------------
+def _cut_point(audio, start_ms: int, target_ms: int) -> int:
+    """
+    Middle of the latest long-enough pause shortly before target_ms
+    (target_ms if none). The search window is at most SILENCE_SEARCH_S and
+    at most SILENCE_SEARCH_FRAC of the segment, so segments stay close to
+    their maximum length.
+    """
+    from pydub.silence import detect_silence
+
+    search_ms = min(SILENCE_SEARCH_S, SILENCE_SEARCH_FRAC * (target_ms - start_ms) / 1000) * 1000
+    lo = max(start_ms, target_ms - int(search_ms))
+    window = audio[lo:target_ms]
+    pauses = detect_silence(
+        window,
+        min_silence_len=MIN_SILENCE_MS,
+        silence_thresh=audio.dBFS - SILENCE_DB_BELOW,
+        seek_step=10,
+    )
+    if not pauses:
+        return target_ms
+    a, b = pauses[-1]
+    return lo + (a + b) // 2
+
+
+def split_on_silence(audio, max_s: float = SEGMENT_MAX_S) -> List[Tuple[int, int]]:
+    """
+    (start_ms, end_ms) segments of at most max_s seconds, each ending in a
+    pause where possible. Silence is only searched near the cut points, so
+    the cost does not grow with the quiet parts of a long recording.
+    """
+    max_ms = int(max_s * 1000)
+    total = len(audio)
+    bounds: List[Tuple[int, int]] = []
+    start = 0
+    while total - start > max_ms:
+        end = _cut_point(audio, start, start + max_ms)
+        bounds.append((start, end))
+        start = end
+    bounds.append((start, total))
+    return bounds
+
+
+# --------------------------
+# Timestamps
+# --------------------------
+def format_ts(seconds: int) -> str:
+    h, rem = divmod(int(seconds), 3600)
+    m, s = divmod(rem, 60)
+    return f"[{h}:{m:02d}:{s:02d}]" if h else f"[{m:02d}:{s:02d}]"
+
+
+def rebase_timestamps(text: str, offset_s: float) -> str:
+    """Shift every [mm:ss] / [h:mm:ss] in a segment transcript by the segment offset."""
+    def shift(m: re.Match) -> str:
+        h, mm, ss = int(m.group(1) or 0), int(m.group(2)), int(m.group(3))
+        return format_ts(h * 3600 + mm * 60 + ss + int(offset_s))
+
+    return TIMESTAMP.sub(shift, text)
+
+
+# --------------------------
+# Parallel transcription
+# --------------------------
+async def _transcribe_segment(clip: Path, system_instruction: Optional[str]) -> str:
+    """Upload + transcribe one clip, retrying the whole segment on failure."""
+    for attempt in range(SEGMENT_RETRIES + 1):
+        try:
+            file_part = await aupload_file(str(clip))
+            resp = await agen_text(SEGMENT_PROMPT, system_instruction=system_instruction, attachments=[file_part])
+            text = (resp.text or "").strip()
+            if not text:
+                raise ValueError("empty transcript")
+            return text
+        except Exception as e:
+            if attempt == SEGMENT_RETRIES:
+                raise RuntimeError(f"Segment {clip.name} failed after {attempt + 1} attempts: {e}") from e
+            print(f"⚠️ Segment {clip.name} failed ({e}); retrying")
+    raise AssertionError("unreachable")
+
+
+def _transcribe_all(
+    clips: List[Tuple[Path, float]],
+    system_instruction: Optional[str],
+    on_text: Optional[Callable[[str], None]],
+) -> List[str]:
+    """
+    Transcribe all clips concurrently on the Gemini loop; results are
+    collected in order on the calling thread, so on_text is never called
+    from the loop (Streamlit elements must be updated from the script thread).
+    """
+    futures = [submit_async(_transcribe_segment(clip, system_instruction)) for clip, _ in clips]
+    merged: List[str] = []
+    try:
+        # Segment i is emitted as soon as it and all earlier ones are done
+        for fut, (_, offset) in zip(futures, clips):
+            text = rebase_timestamps(fut.result(), offset)
+            merged.append(text)
+            if on_text is not None:
+                on_text(text if len(merged) == 1 else "\n\n" + text)
+    finally:
+        for fut in futures:
+            fut.cancel()
+    return merged
+
+
+def transcribe_audio(
+    audio,
+    source: str,
+    system_instruction: Optional[str] = None,
+    on_text: Optional[Callable[[str], None]] = None,
+    max_segment_s: float = SEGMENT_MAX_S,
+) -> Optional[str]:
+    """
+    Split decoded speech audio (media_prep.load_speech of `source`) on
+    silence into bounded segments, transcribe them concurrently (bounded by
+    GEMINI_MAX_CONCURRENCY) and merge in order with timestamps rebased to
+    the full recording.
+    Returns None if the recording fits in one segment (the caller sends it
+    whole).
+    """
+    bounds = split_on_silence(audio, max_segment_s)
+    print(f"🎧 {len(audio) / 1000:.0f}s of audio -> {len(bounds)} segments")
+    if len(bounds) == 1:
+        return None
+
+    with tempfile.TemporaryDirectory(prefix="segments-") as tmp:
+        clips = []
+        for i, (a, b) in enumerate(bounds):
+            clip = export_speech(audio[a:b], Path(tmp) / f"{Path(source).stem}_{i:03d}")
+            clips.append((clip, a / 1000))
+        report_savings(Path(source), [clip for clip, _ in clips])
+        parts = _transcribe_all(clips, system_instruction, on_text)
+    return "\n\n".join(parts)
@@ -0,0 +1,111 @@
+from __future__ import annotations
+import json
+import re
+from collections import Counter
+from pathlib import Path
+from typing import Iterable, List, Optional, Tuple
+import numpy as np
+
+from .kb_store import atomic_write, topk
+
+TOKEN_RE = re.compile(r"[a-z0-9]+(?:[-/][a-z0-9]+)*")
+STOPWORDS = frozenset(
+    "a an and are as at be but by for from has have in is it its of on or so that the "
+    "then there these this to was were which while will with we you they our your".split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase word tokens without stopwords."""
+    return [t for t in TOKEN_RE.findall(text.lower()) if t not in STOPWORDS]
+
+
+# --------------------------
+# Inverted index with BM25 weights
+# --------------------------
+class BM25Index:
+    """
+    Inverted index over the KB chunks. Each posting stores its final BM25
+    term weight (idf * saturated tf, length-normalized), so a query is just
+    a weighted bincount over the postings of its terms.
+    """
+
+    def __init__(self, vocab: dict, offsets: np.ndarray, docs: np.ndarray, weights: np.ndarray, n_docs: int):
+        self.vocab = vocab                                   # term -> posting list id
+        self.offsets = np.asarray(offsets, dtype=np.int64)   # (n_terms + 1,)
+        self.docs = np.asarray(docs, dtype=np.int32)         # row ids, grouped by term
+        self.weights = np.asarray(weights, dtype=np.float32) # BM25 weight per posting
+        self.n_docs = int(n_docs)
+
+    @classmethod
+    def build(cls, texts: Iterable[str], k1: float = 1.5, b: float = 0.75) -> "BM25Index":
+        tfs = [Counter(tokenize(t)) for t in texts]
+        doc_len = np.array([sum(c.values()) for c in tfs], dtype=np.float32)
+        avgdl = float(doc_len.mean()) if len(doc_len) and doc_len.mean() > 0 else 1.0
+
+        postings: dict = {}
+        for doc, counts in enumerate(tfs):
+            for term, tf in counts.items():
+                postings.setdefault(term, []).append((doc, tf))
+
+        n = len(tfs)
+        vocab, offsets, docs, weights = {}, [0], [], []
+        for term, plist in postings.items():
+            d = np.array([p[0] for p in plist], dtype=np.int32)
+            tf = np.array([p[1] for p in plist], dtype=np.float32)
+            idf = np.log(1.0 + (n - len(d) + 0.5) / (len(d) + 0.5))
+            w = idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * doc_len[d] / avgdl))
+            vocab[term] = len(vocab)
+            docs.append(d)
+            weights.append(w)
+            offsets.append(offsets[-1] + len(d))
+
+        return cls(
+            vocab,
+            np.array(offsets),
+            np.concatenate(docs) if docs else np.empty(0),
+            np.concatenate(weights) if weights else np.empty(0),
+            n,
+        )
+
+    def scores(self, query: str) -> np.ndarray:
+        """BM25 score of every row for the query (unique query terms)."""
+        ids = [self.vocab[t] for t in set(tokenize(query)) if t in self.vocab]
+        if not ids:
+            return np.zeros(self.n_docs, dtype=np.float32)
+        docs = np.concatenate([self.docs[self.offsets[i] : self.offsets[i + 1]] for i in ids])
+        w = np.concatenate([self.weights[self.offsets[i] : self.offsets[i + 1]] for i in ids])
+        return np.bincount(docs, weights=w, minlength=self.n_docs).astype(np.float32)
+
+    def search(self, query: str, k: int = 8, rows: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Return (row ids, BM25 scores) of the top-k rows with a non-zero score,
+        optionally restricted to the given row ids.
+        """
+        scores = self.scores(query)
+        if rows is not None:
+            idx, sc = topk(scores[rows], k)
+            idx = rows[idx]
+        else:
+            idx, sc = topk(scores, k)
+        keep = sc > 0
+        return idx[keep], sc[keep]
+
+    def save(self, path: Path) -> Path:
+        """Write the index atomically (see kb_store.atomic_write) as .npz, vocab stored as JSON."""
+        path = Path(path)
+        with atomic_write(path) as f:
+            np.savez(
+                f,
+                vocab=np.array(json.dumps(self.vocab)),
+                offsets=self.offsets,
+                docs=self.docs,
+                weights=self.weights,
+                n_docs=np.array(self.n_docs),
+            )
+        return path
+
+    @classmethod
+    def load(cls, path: Path) -> "BM25Index":
+        with np.load(Path(path)) as z:
+            return cls(json.loads(str(z["vocab"])), z["offsets"], z["docs"], z["weights"], int(z["n_docs"]))
@@ -0,0 +1,97 @@
+from __future__ import annotations
+import os
+from typing import List, Optional, Sequence
+from pydantic import BaseModel
+
+from utils.tokens import count_tokens, truncate_tokens
+
+# --------------------------
+# Budgets (tokens)
+# --------------------------
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "32000"))  # transcript + KB context
+KB_TOKEN_BUDGET = int(os.getenv("KB_TOKEN_BUDGET", "4000"))           # cap on the KB share
+
+KB_HEADER = "Relevant Context (course knowledge base):"
+
+
+class PackedPrompt(BaseModel):
+    text: str
+    transcript_tokens: int
+    kb_tokens: int
+    chunks_used: int
+    chunks_dropped: int
+    transcript_truncated: bool = False
+
+    @property
+    def tokens(self) -> int:
+        return self.transcript_tokens + self.kb_tokens
+
+
+def compact_chunk(hit) -> str:
+    """One KB chunk as a single line: [course | tags] text"""
+    label = hit.course
+    if hit.topic_tags:
+        label += " | " + ", ".join(hit.topic_tags)
+    return f"- [{label}] {' '.join(hit.text.split())}"
+
+
+def pack_context(
+    transcript: str,
+    hits: Optional[Sequence] = None,
+    budget: int = PROMPT_TOKEN_BUDGET,
+    kb_budget: int = KB_TOKEN_BUDGET,
+) -> PackedPrompt:
+    """
+    Fit transcript + KB context into `budget` tokens.
+    The transcript has priority: it may use everything except the KB share
+    actually needed (at most `kb_budget`), and is only truncated beyond that.
+    KB hits (retriever.RetrievedChunk, best first) are then packed greedily
+    in compact form into what is left; a chunk that does not fit is skipped
+    and smaller, lower-ranked ones are still tried.
+    """
+    hits = list(hits or [])
+    lines: List[str] = []
+    seen = set()
+    for h in hits:
+        line = compact_chunk(h)
+        if line not in seen:
+            seen.add(line)
+            lines.append(line)
+    costs = [count_tokens(line) + 1 for line in lines]  # + newline
+    kb_need = min(kb_budget, count_tokens(KB_HEADER) + 2 + sum(costs)) if lines else 0
+
+    t_tokens = count_tokens(transcript)
+    truncated = t_tokens > budget - kb_need
+    if truncated:
+        transcript = truncate_tokens(transcript, max(0, budget - kb_need))
+        print(f"⚠️ Transcript truncated from {t_tokens} to {budget - kb_need} tokens to fit the prompt budget")
+        t_tokens = count_tokens(transcript)
+
+    # Greedy packing in rank order into the remaining KB room
+    room = min(kb_budget, budget - t_tokens) - count_tokens(KB_HEADER) - 2
+    packed: List[str] = []
+    for line, cost in zip(lines, costs):
+        if cost <= room:
+            packed.append(line)
+            room -= cost
+
+    text = transcript
+    kb_tokens = 0
+    if packed:
+        kb_block = KB_HEADER + "\n" + "\n".join(packed)
+        kb_tokens = count_tokens(kb_block) + 2
+        text = f"{transcript}\n\n{kb_block}"
+
+    packed_prompt = PackedPrompt(
+        text=text,
+        transcript_tokens=t_tokens,
+        kb_tokens=kb_tokens,
+        chunks_used=len(packed),
+        chunks_dropped=len(hits) - len(packed),
+        transcript_truncated=truncated,
+    )
+    print(
+        f"✅ Packed prompt: {t_tokens} transcript + {kb_tokens} KB tokens "
+        f"({len(packed)}/{len(hits)} chunks) of a {budget}-token budget"
+    )
+    return packed_prompt
@@ -1,31 +1,207 @@
 from __future__ import annotations
+import asyncio
+import hashlib
+import io
+import itertools
+import json
+import mimetypes
 import os
-from typing import Any, Dict, Optional, List, Union
-from google import genai
-from google.genai import types
+import time
+from array import array
+from concurrent.futures import Future
+from contextlib import asynccontextmanager, contextmanager
+from pathlib import Path
+import threading
+from typing import TYPE_CHECKING, Any, AsyncIterator, Awaitable, Callable, Dict, Iterator, Optional, List, TypeVar, Union
 from dotenv import load_dotenv
+from utils.disk_cache import DiskCache
+from .rate_limit import EMBED_LIMITER, GENERATE_LIMITER, acall_with_retry, call_with_retry
+from utils.fs import CACHE_DIR
+
+if TYPE_CHECKING:  # the SDK is imported on first use, not at import time
+    from google import genai
+    from google.genai import types
 
 # --------------------------
 # Load environment --
 # --------------------------
 load_dotenv()
 
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-if not GEMINI_API_KEY:
-    raise RuntimeError(
-        "❌ GEMINI_API_KEY not set. Create a .env file from .env.example and add your key."
-    )
-
 MODEL = os.getenv("GEMINI_MODEL", "gemini-2.0-flash")  # default model
+T = TypeVar("T")
 
 # --------------------------
-# Client
+# Client (built lazily)
 # --------------------------
-client = genai.Client(api_key=GEMINI_API_KEY)
+# Every API call below goes through agents.rate_limit: RPM/TPM token buckets
+# shared by all threads, plus jittered exponential backoff on 429/5xx.
+_client: Optional["genai.Client"] = None
+_client_lock = threading.Lock()
+
+def get_client() -> "genai.Client":
+    """
+    The shared Gemini client, built on first use so importing this module
+    neither loads the SDK nor requires GEMINI_API_KEY.
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                api_key = os.getenv("GEMINI_API_KEY")
+                if not api_key:
+                    raise RuntimeError(
+                        "❌ GEMINI_API_KEY not set. Create a .env file from .env.example and add your key."
+                    )
+                from google import genai
+
+                _client = genai.Client(api_key=api_key)
+    return _client
+
+# --------------------------
+# Concurrency limit
+# --------------------------
+# One process-wide pool of GEMINI_MAX_CONCURRENCY slots shared by every
+# thread, event loop and Streamlit session: sync calls (e.g. clean_chunked's
+# worker threads) and async calls (on the Gemini loop, see run_sync) draw
+# from the same slots. A slot is held only while a request is in flight, not
+# during rate-limit waits or retry backoff.
+GEMINI_MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", "8"))
+SLOT_POLL_S = 0.05
+_slots = threading.BoundedSemaphore(GEMINI_MAX_CONCURRENCY)
+
+@contextmanager
+def _slot() -> Iterator[None]:
+    """Hold one request slot (blocking the calling thread)"""
+    with _slots:
+        yield
+
+@asynccontextmanager
+async def _aslot() -> AsyncIterator[None]:
+    """Hold one request slot without blocking the event loop (cancellation-safe polling)"""
+    while not _slots.acquire(blocking=False):
+        await asyncio.sleep(SLOT_POLL_S)
+    try:
+        yield
+    finally:
+        _slots.release()
 
 # --------------------------
 # Text generation
 # --------------------------
+def _gen_request(
+    prompt: Union[str, List[Any]],
+    system_instruction: Optional[str],
+    temperature: float,
+    response_schema: Optional[Any],
+    mime: Optional[str],
+    attachments: Optional[list],
+) -> Dict[str, Any]:
+    """generate_content kwargs shared by gen_text and agen_text"""
+    from google.genai import types
+
+    cfg = types.GenerateContentConfig(
+        temperature=temperature,
+        system_instruction=system_instruction,
+        response_mime_type=mime or ("application/json" if response_schema else None),
+        response_schema=response_schema,
+    )
+
+    contents: List[Any] = []
+    if attachments:
+        contents.extend(attachments)
+    contents.append(prompt)
+    return {"model": MODEL, "contents": contents, "config": cfg}
+
+def _request_tokens(req: Dict[str, Any]) -> int:
+    """Prompt tokens of a request, for the tokens-per-minute limiter (text parts only)."""
+    from utils.tokens import count_tokens as _count
+
+    texts = [req["config"].system_instruction or ""]
+    stack = list(req["contents"])
+    while stack:
+        item = stack.pop()
+        if isinstance(item, str):
+            texts.append(item)
+        elif isinstance(item, list):
+            stack.extend(item)
+    return sum(_count(t) for t in texts)
+
+# --------------------------
+# Response cache (opt-in)
+# --------------------------
+# Identical requests (same model, system instruction, prompt, schema,
+# temperature, mime and attachment contents) are answered from disk.
+# Enable with GEN_CACHE=1 or gen_text(..., cache=True).
+GEN_CACHE_ENABLED = os.getenv("GEN_CACHE", "0") == "1"
+_gen_cache: Optional[DiskCache] = None
+
+def _get_gen_cache() -> DiskCache:
+    """Open the on-disk response cache on first use"""
+    global _gen_cache
+    if _gen_cache is None:
+        _gen_cache = DiskCache(
+            CACHE_DIR / "responses.sqlite",
+            max_bytes=int(os.getenv("GEN_CACHE_MB", "256")) * 2**20,
+            ttl=float(os.getenv("GEN_CACHE_TTL_H", "168")) * 3600,
+        )
+    return _gen_cache
+
+def _jsonable(obj: Any) -> Any:
+    """json.dumps fallback for SDK/pydantic objects and schema classes"""
+    if isinstance(obj, type) and hasattr(obj, "model_json_schema"):
+        return obj.model_json_schema()
+    if hasattr(obj, "model_dump"):
+        return obj.model_dump(mode="json", exclude_none=True)
+    if isinstance(obj, bytes):
+        return hashlib.sha256(obj).hexdigest()
+    return repr(obj)
+
+def _digest(obj: Any) -> str:
+    data = obj if isinstance(obj, str) else json.dumps(obj, sort_keys=True, default=_jsonable)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+def _attachment_digest(a: Any) -> str:
+    """Uploaded files are identified by their content hash, not their upload name"""
+    return getattr(a, "sha256_hash", None) or getattr(a, "uri", None) or _digest(a)
+
+def _gen_key(
+    prompt: Union[str, List[Any]],
+    system_instruction: Optional[str],
+    temperature: float,
+    response_schema: Optional[Any],
+    mime: Optional[str],
+    attachments: Optional[list],
+) -> str:
+    """Content address of one generate_content request."""
+    parts = {
+        "model": MODEL,
+        "system": _digest(system_instruction or ""),
+        "prompt": _digest(prompt),
+        "schema": _digest(response_schema) if response_schema is not None else None,
+        "temperature": temperature,
+        "mime": mime,
+        "attachments": [_attachment_digest(a) for a in attachments or []],
+    }
+    return "gen:" + _digest(parts)
+
+def _cached_response(key: str) -> Optional[types.GenerateContentResponse]:
+    from google.genai import types
+
+    raw = _get_gen_cache().get(key)
+    if raw is None:
+        return None
+    print("🧠 Response cache hit")
+    return types.GenerateContentResponse.model_validate_json(raw)
+
+def _store_response(key: str, res: types.GenerateContentResponse) -> None:
+    # Only complete answers are worth replaying; `parsed` is rebuilt from text by callers
+    if res.candidates:
+        _get_gen_cache().put(key, res.model_dump_json(exclude_none=True, exclude={"parsed"}).encode("utf-8"))
+
+def gen_cache_stats() -> Dict[str, float]:
+    """Hit/miss counters and size of the response cache."""
+    return _get_gen_cache().stats()
+
 def gen_text(
     prompt: Union[str, List[Any]],
     system_instruction: Optional[str] = None,
@@ -33,6 +209,7 @@ def gen_text(
     response_schema: Optional[Any] = None,
     mime: Optional[str] = None,
     attachments: Optional[list] = None,
+    cache: Optional[bool] = None,
 ) -> types.GenerateContentResponse:
     """
     Generate text/content from Gemini.
@@ -42,60 +219,413 @@ def gen_text(
     - response_schema: optional pydantic schema for structured output
     - mime: enforce mime type (e.g. application/json)
     - attachments: list of pre-processed file attachments
+    - cache: use the response cache (default: GEN_CACHE env var)
     """
-    cfg = types.GenerateContentConfig(
-        temperature=temperature,
-        system_instruction=system_instruction,
-        response_mime_type=mime or ("application/json" if response_schema else None),
-        response_schema=response_schema,
-    )
+    use_cache = GEN_CACHE_ENABLED if cache is None else cache
+    if use_cache:
+        key = _gen_key(prompt, system_instruction, temperature, response_schema, mime, attachments)
+        cached = _cached_response(key)
+        if cached is not None:
+            return cached
 
-    contents: List[Any] = []
-    if attachments:
-        contents.extend(attachments)
-    contents.append(prompt)
+    req = _gen_request(prompt, system_instruction, temperature, response_schema, mime, attachments)
+    def call():
+        with _slot():
+            return get_client().models.generate_content(**req)
 
-    res = client.models.generate_content(
-        model=MODEL,
-        contents=contents,
-        config=cfg,
-    )
+    res = call_with_retry(call, GENERATE_LIMITER, _request_tokens(req))
+    if use_cache:
+        _store_response(key, res)
     return res
 
+def gen_text_stream(
+    prompt: Union[str, List[Any]],
+    system_instruction: Optional[str] = None,
+    temperature: float = 0.2,
+    mime: Optional[str] = None,
+    attachments: Optional[list] = None,
+    cache: Optional[bool] = None,
+) -> Iterator[str]:
+    """
+    Streaming gen_text: yields text fragments as Gemini produces them.
+    Only opening the stream (up to the first fragment) is retried, so no
+    fragment is ever repeated. A cached response is yielded in one piece;
+    a completed stream is cached like a gen_text response.
+    """
+    use_cache = GEN_CACHE_ENABLED if cache is None else cache
+    if use_cache:
+        key = _gen_key(prompt, system_instruction, temperature, None, mime, attachments)
+        cached = _cached_response(key)
+        if cached is not None:
+            yield cached.text or ""
+            return
+
+    req = _gen_request(prompt, system_instruction, temperature, None, mime, attachments)
+
+    def open_stream():
+        # A successful attempt keeps its slot until the stream is drained (or abandoned)
+        _slots.acquire()
+        try:
+            chunks = iter(get_client().models.generate_content_stream(**req))
+            return next(chunks, None), chunks
+        except BaseException:
+            _slots.release()
+            raise
+
+    first, chunks = call_with_retry(open_stream, GENERATE_LIMITER, _request_tokens(req))
+    parts: List[str] = []
+    try:
+        for chunk in chunks if first is None else itertools.chain([first], chunks):
+            text = chunk.text or ""
+            if text:
+                parts.append(text)
+                yield text
+    finally:
+        _slots.release()
+
+    if use_cache:
+        from google.genai import types
+
+        full = types.GenerateContentResponse(
+            candidates=[types.Candidate(content=types.Content(role="model", parts=[types.Part(text="".join(parts))]))]
+        )
+        _store_response(key, full)
+
 # --------------------------
-# Embedding
+# Embedding (with persistent cache)
 # --------------------------
-def embed_texts(texts: List[str], model: str = "text-embedding-004") -> List[List[float]]:
+# Backends: "gemini" (text-embedding-004 over the API) or "hash" (local hashed
+# n-gram projection, see agents.local_embed). The backend a KB was built with
+# is recorded in kb_meta.json and reused for its queries.
+EMBED_BACKENDS = ("gemini", "hash")
+EMBED_BACKEND = os.getenv("EMBED_BACKEND", "gemini")
+GEMINI_EMBED_MODEL = "text-embedding-004"
+EMBED_BATCH_SIZE = 32
+EMBED_CACHE_ENABLED = os.getenv("EMBED_CACHE", "1") != "0"
+_embed_cache: Optional[DiskCache] = None
+
+def _get_embed_cache() -> DiskCache:
+    """Open the on-disk embedding cache on first use"""
+    global _embed_cache
+    if _embed_cache is None:
+        _embed_cache = DiskCache(
+            CACHE_DIR / "embeddings.sqlite",
+            max_bytes=int(os.getenv("EMBED_CACHE_MB", "512")) * 2**20,
+        )
+    return _embed_cache
+
+def _embed_key(model: str, text: str) -> str:
+    """Content address of one embedding: (model, sha256 of text)."""
+    return model + ":" + hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def default_embed_model(backend: str) -> str:
+    """Embedding model used by a backend when none is given."""
+    if backend == "hash":
+        from .local_embed import hash_model
+        return hash_model()
+    return GEMINI_EMBED_MODEL
+
+class _EmbedJob:
+    """
+    One embed_texts call: resolves the backend, serves cache hits and lists
+    the unique misses as API batches. Shared by the sync and async paths.
+    """
+
+    def __init__(self, texts: List[str], model: Optional[str], backend: Optional[str]):
+        self.backend = backend or EMBED_BACKEND
+        if self.backend not in EMBED_BACKENDS:
+            raise ValueError(f"Unknown embedding backend: {self.backend} (expected one of {EMBED_BACKENDS})")
+        self.model = model or default_embed_model(self.backend)
+        self.texts = texts
+        self.local: Optional[List[List[float]]] = None
+        if self.backend == "hash":
+            from .local_embed import hash_dim, hash_embed
+            self.local = hash_embed(texts, dim=hash_dim(self.model)).tolist()
+            return
+
+        self.keys = [_embed_key(self.model, t) for t in texts]
+        self.found: Dict[str, List[float]] = {}
+        if EMBED_CACHE_ENABLED:
+            self.found = {k: array("f", v).tolist() for k, v in _get_embed_cache().get_many(self.keys).items()}
+        # Unique misses, in first-seen order
+        self.missing = {k: t for k, t in zip(self.keys, texts) if k not in self.found}
+        miss_keys = list(self.missing)
+        self.batches = [miss_keys[i : i + EMBED_BATCH_SIZE] for i in range(0, len(miss_keys), EMBED_BATCH_SIZE)]
+
+    def contents(self, batch: List[str]) -> List[str]:
+        return [self.missing[k] for k in batch]
+
+    def finish(self, results: List[tuple]) -> List[List[float]]:
+        """results: (batch keys, EmbedContentResponse) per batch"""
+        if self.local is not None:
+            return self.local
+        fresh = {}
+        for batch, resp in results:
+            for k, emb in zip(batch, resp.embeddings):
+                fresh[k] = list(emb.values)
+        if EMBED_CACHE_ENABLED:
+            _get_embed_cache().put_many({k: array("f", v).tobytes() for k, v in fresh.items()})
+            print(f"🧠 Embedding cache: {len(set(self.keys)) - len(self.missing)} hits, {len(self.missing)} misses")
+        self.found.update(fresh)
+        return [self.found[k] for k in self.keys]
+
+def embed_texts(
+    texts: List[str],
+    model: Optional[str] = None,
+    backend: Optional[str] = None,
+    parallel: bool = False,
+) -> List[List[float]]:
     """
     Generate embeddings for a list of texts.
     Returns a list of vectors (list of floats).
+    - backend: "gemini" or "hash" (default: EMBED_BACKEND env var)
+    - model: backend model name (default: the backend's default)
+    - parallel: send the API batches concurrently (see aembed_texts)
+    Gemini vectors are looked up in the cache in bulk; only the misses
+    (deduplicated) are sent to the API, in batches. Hashed vectors are
+    computed in-process and never cached.
     """
-    vectors: List[List[float]] = []
-    BATCH_SIZE = 32
+    job = _EmbedJob(texts, model, backend)
+    if job.local is not None:
+        return job.local
+    if parallel and len(job.batches) > 1:
+        return job.finish(run_sync(_aembed_batches(job)))
+    def embed(batch: List[str]):
+        with _slot():
+            return get_client().models.embed_content(model=job.model, contents=job.contents(batch))
 
-    for i in range(0, len(texts), BATCH_SIZE):
-        batch = texts[i : i + BATCH_SIZE]
-        resp = client.models.embed_content(model=model, contents=batch)
-        for emb in resp.embeddings:
-            vectors.append(emb.values)
+    results = [(batch, call_with_retry(lambda: embed(batch), EMBED_LIMITER)) for batch in job.batches]
+    return job.finish(results)
 
-    return vectors
+def embed_cache_stats() -> Dict[str, float]:
+    """Hit/miss counters and size of the embedding cache."""
+    return _get_embed_cache().stats()
 
 # --------------------------
 # File upload
 # --------------------------
-def upload_file(path: str):
+# Uploads are remembered by content hash: re-processing the same recording
+# reuses the remote file while it is still valid instead of sending it again.
+# The SDK uploads with the resumable protocol in 8 MB chunks; _ProgressFile
+# reports the bytes read for each chunk.
+UPLOAD_TTL_S = 47 * 3600      # Gemini keeps uploaded files for 48 h
+UPLOAD_REUSE_MARGIN_S = 600   # don't reuse a file that expires within 10 min
+_upload_registry: Optional[DiskCache] = None
+
+ProgressFn = Callable[[int, int], None]  # (bytes sent, total bytes)
+
+def _get_upload_registry() -> DiskCache:
+    """Open the content hash -> remote file registry on first use"""
+    global _upload_registry
+    if _upload_registry is None:
+        _upload_registry = DiskCache(CACHE_DIR / "uploads.sqlite", max_bytes=4 * 2**20, ttl=UPLOAD_TTL_S)
+    return _upload_registry
+
+def file_digest(path: str, block: int = 2**20) -> str:
+    """sha256 of a file's contents, read in 1 MB blocks."""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(block), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+class _ProgressFile(io.FileIO):
+    """Binary file that reports read progress to a callback."""
+
+    def __init__(self, path: str, on_progress: ProgressFn):
+        super().__init__(path, "rb")
+        self.total = os.path.getsize(path)
+        self.on_progress = on_progress
+
+    def read(self, size: int = -1) -> bytes:
+        data = super().read(size)
+        self.on_progress(self.tell(), self.total)
+        return data
+
+def _upload_config(path: str) -> Dict[str, Any]:
+    mime, _ = mimetypes.guess_type(path)
+    return {"display_name": Path(path).name, **({"mime_type": mime} if mime else {})}
+
+def _registered(digest: str) -> Optional[Dict[str, Any]]:
+    """Registry entry for a content hash if it is not about to expire"""
+    raw = _get_upload_registry().get("upload:" + digest)
+    if raw is None:
+        return None
+    entry = json.loads(raw)
+    if entry["expires"] - time.time() < UPLOAD_REUSE_MARGIN_S:
+        return None
+    return entry
+
+def _register(digest: str, remote: Any) -> None:
+    expires = remote.expiration_time.timestamp() if remote.expiration_time else time.time() + UPLOAD_TTL_S
+    entry = {"name": remote.name, "uri": remote.uri, "expires": expires}
+    _get_upload_registry().put("upload:" + digest, json.dumps(entry).encode("utf-8"))
+
+def _usable(remote: Any) -> bool:
+    state = getattr(remote, "state", None)
+    return getattr(state, "name", state) != "FAILED"
+
+def upload_file(path: str, on_progress: Optional[ProgressFn] = None, reuse: bool = True):
     """
     Upload file to Gemini for multimodal usage.
+    - on_progress: called with (bytes sent, total bytes) per uploaded chunk
+    - reuse: return the earlier upload of identical content if still valid
     """
-    return client.files.upload(file=path)
+    digest = file_digest(path)
+    entry = _registered(digest) if reuse else None
+    if entry is not None:
+        try:
+            remote = get_client().files.get(name=entry["name"])
+            if _usable(remote):
+                print(f"✅ Reusing upload {entry['name']} for {Path(path).name}")
+                return remote
+        except Exception as e:
+            print(f"⚠️ Registered upload {entry['name']} unavailable ({e}); uploading again")
+
+    def send():
+        with _slot():
+            if on_progress is None:
+                return get_client().files.upload(file=path)
+            with _ProgressFile(path, on_progress) as f:
+                return get_client().files.upload(file=f, config=_upload_config(path))
+
+    remote = call_with_retry(send)
+    _register(digest, remote)
+    return remote
 
 # --------------------------
-# Token counting (heuristic)
+# Async client (client.aio)
+# --------------------------
+# Awaitable versions of the calls above. Every request holds one of the
+# process-wide slots (see _aslot), so at most GEMINI_MAX_CONCURRENCY calls
+# are in flight however many tasks, loops and threads are running.
+# client.aio keeps one httpx connection pool, bound to the event loop of its
+# first request, so all aio requests run on one long-lived background loop:
+# run_sync / submit_async schedule coroutines on it, and awaiting from any other loop hands
+# the request over to it (_on_loop).
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_loop_lock = threading.Lock()
+
+def _gemini_loop() -> asyncio.AbstractEventLoop:
+    """The background event loop all client.aio requests run on, started on first use"""
+    global _loop
+    if _loop is None:
+        with _loop_lock:
+            if _loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="gemini-aio", daemon=True).start()
+                _loop = loop
+    return _loop
+
+async def _on_loop(coro: Awaitable[T]) -> T:
+    """Await a client.aio request on the Gemini loop, whichever loop the caller runs on"""
+    loop = _gemini_loop()
+    if asyncio.get_running_loop() is loop:
+        return await coro
+    return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, loop))
+
+def submit_async(coro: Awaitable[T]) -> "Future[T]":
+    """Start a coroutine on the Gemini loop; returns a concurrent.futures.Future for its result."""
+    return asyncio.run_coroutine_threadsafe(coro, _gemini_loop())
+
+def run_sync(coro: Awaitable[T]) -> T:
+    """Run a coroutine from sync code (on the Gemini loop; blocks until it finishes)."""
+    loop = _gemini_loop()
+    try:
+        running = asyncio.get_running_loop()
+    except RuntimeError:
+        running = None
+    if running is loop:
+        raise RuntimeError("run_sync() called on the Gemini loop; await the coroutine instead")
+    fut = submit_async(coro)
+    try:
+        return fut.result()
+    except BaseException:
+        fut.cancel()
+        raise
+
+async def agen_text(
+    prompt: Union[str, List[Any]],
+    system_instruction: Optional[str] = None,
+    temperature: float = 0.2,
+    response_schema: Optional[Any] = None,
+    mime: Optional[str] = None,
+    attachments: Optional[list] = None,
+    cache: Optional[bool] = None,
+) -> types.GenerateContentResponse:
+    """Awaitable gen_text (same arguments, same response cache)."""
+    use_cache = GEN_CACHE_ENABLED if cache is None else cache
+    if use_cache:
+        key = _gen_key(prompt, system_instruction, temperature, response_schema, mime, attachments)
+        cached = _cached_response(key)
+        if cached is not None:
+            return cached
+
+    req = _gen_request(prompt, system_instruction, temperature, response_schema, mime, attachments)
+
+    async def call():
+        async with _aslot():
+            return await _on_loop(get_client().aio.models.generate_content(**req))
+
+    res = await acall_with_retry(call, GENERATE_LIMITER, _request_tokens(req))
+    if use_cache:
+        _store_response(key, res)
+    return res
+
+async def _aembed_batches(job: _EmbedJob) -> List[tuple]:
+    """Send all of a job's API batches concurrently"""
+    async def one(batch: List[str]) -> tuple:
+        async def call():
+            async with _aslot():
+                return await _on_loop(
+                    get_client().aio.models.embed_content(model=job.model, contents=job.contents(batch))
+                )
+
+        return batch, await acall_with_retry(call, EMBED_LIMITER)
+
+    return list(await asyncio.gather(*(one(b) for b in job.batches)))
+
+async def aembed_texts(
+    texts: List[str], model: Optional[str] = None, backend: Optional[str] = None
+) -> List[List[float]]:
+    """
+    Awaitable embed_texts: the cache is consulted as usual and the missing
+    batches are embedded in parallel (bounded by GEMINI_MAX_CONCURRENCY).
+    """
+    job = _EmbedJob(texts, model, backend)
+    if job.local is not None:
+        return job.local
+    return job.finish(await _aembed_batches(job))
+
+async def aupload_file(path: str, reuse: bool = True):
+    """Awaitable upload_file (same upload registry)."""
+    digest = await asyncio.to_thread(file_digest, path)
+    entry = _registered(digest) if reuse else None
+    if entry is not None:
+        try:
+            remote = await _on_loop(get_client().aio.files.get(name=entry["name"]))
+            if _usable(remote):
+                print(f"✅ Reusing upload {entry['name']} for {Path(path).name}")
+                return remote
+        except Exception as e:
+            print(f"⚠️ Registered upload {entry['name']} unavailable ({e}); uploading again")
+
+    async def call():
+        async with _aslot():
+            return await _on_loop(get_client().aio.files.upload(file=path))
+
+    remote = await acall_with_retry(call)
+    _register(digest, remote)
+    return remote
+
+# --------------------------
+# Token counting
 # --------------------------
 def count_tokens(text: str) -> int:
     """
-    Approximate token count for budgeting.
-    Gemini tokens ≈ 4 characters/token in English.
+    Token count for budgeting (tiktoken BPE, estimated if unavailable).
+    See utils.tokens.
     """
-    return max(1, len(text) // 4)
\ No newline at end of file
+    from utils.tokens import count_tokens as _count
+
+    return _count(text)
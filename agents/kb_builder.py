@@ -0,0 +1,277 @@
+"""
+Incremental KB builder.
+
+    python -m agents.kb_builder [--seed data/kb/it_lectures_seed.jsonl] [--kb-dir data/kb] [--backend gemini|hash]
+
+Streams the seed JSONL, chunks each lecture transcript and hashes every
+chunk. Only new or changed chunks are embedded; unchanged rows are copied
+from the live KB, deleted chunks are dropped and new chunks are appended.
+Each build is written to data/kb/versions/<version>/ and published by
+atomically swapping data/kb/CURRENT, so readers never see a half-written KB.
+The embedding backend and model are recorded in kb_meta.json; the retriever
+embeds queries with the same ones.
+"""
+from __future__ import annotations
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterator, List, Tuple
+import numpy as np
+
+from .ann_index import ANN_MIN_ROWS, build_ivf
+from .bm25 import BM25Index
+from .kb_store import (
+    ANN_NAME, BM25_NAME, CHUNKS_NAME, CURRENT_FILE, EMB_NAME, META_NAME, VEC_NAME,
+    VECTOR_DTYPE, VERSIONS_DIR, atomic_write, current_kb_dir, open_vectors, read_meta, write_vectors,
+)
+
+KB_ROOT = Path("data/kb")
+SEED = KB_ROOT / "it_lectures_seed.jsonl"
+EMBED_FLUSH = 256  # texts embedded per flush to the spool file
+COPY_BLOCK = 65536  # rows copied per block into the new matrix
+
+
+# --------------------------
+# Chunking + hashing
+# --------------------------
+def chunk_text(text: str, max_words: int = 120) -> List[str]:
+    words = text.split()
+    chunks = []
+    for i in range(0, len(words), max_words):
+        piece = " ".join(words[i:i+max_words]).strip()
+        if piece:
+            chunks.append(piece)
+    return chunks
+
+
+def chunk_hash(text: str) -> str:
+    """Content hash deciding whether a chunk needs a new embedding."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def iter_seed_chunks(seed: Path, max_words: int = 120) -> Iterator[Dict]:
+    """Stream chunk records from the seed JSONL, one lecture at a time."""
+    with open(seed, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            r = json.loads(line)
+            for j, ch in enumerate(chunk_text(r.get("transcript", ""), max_words=max_words)):
+                yield {
+                    "id": f'{r["id"]}_c{j}',
+                    "parent_id": r["id"],
+                    "course": r.get("course", "Unknown"),
+                    "topic_tags": r.get("topic_tags", []),
+                    "text": ch,
+                    "hash": chunk_hash(ch),
+                }
+
+
+# --------------------------
+# Previous version
+# --------------------------
+def _read_previous(
+    kb_dir: Path, backend: str, model: str
+) -> Tuple[Dict[str, Tuple[int, str]], int, Path | None]:
+    """
+    Map chunk id -> (row, hash) for the live KB, plus its row count and raw
+    embedding file. Rows embedded with another backend/model are not reusable.
+    """
+    chunks_file, emb_file = kb_dir / CHUNKS_NAME, kb_dir / EMB_NAME
+    if not chunks_file.exists() or not emb_file.exists():
+        return {}, 0, None
+    meta = read_meta(kb_dir)
+    old = (meta["backend"], meta.get("model", model))
+    if old != (backend, model):
+        print(f"Embedding model changed ({'/'.join(old)} -> {backend}/{model}); re-embedding everything")
+        return {}, 0, None
+
+    rows: Dict[str, Tuple[int, str]] = {}
+    with open(chunks_file, "r", encoding="utf-8") as f:
+        for row, line in enumerate(f):
+            c = json.loads(line)
+            rows[c["id"]] = (row, c.get("hash") or chunk_hash(c.get("text", "")))
+    return rows, len(rows), emb_file
+
+
+# --------------------------
+# Build
+# --------------------------
+class _EmbedSpool:
+    """Embeds texts in batches and appends float32 rows to a raw spool file."""
+
+    def __init__(self, path: Path, backend: str, model: str):
+        from .gemini_client import embed_texts  # imported only when building
+
+        self._embed = embed_texts
+        self.path, self.backend, self.model = path, backend, model
+        self.pending: List[str] = []
+        self.rows = 0
+        self.dim = 0
+        self._f = open(path, "wb")
+
+    def add(self, text: str) -> int:
+        """Queue one text; returns its row in the spool."""
+        self.pending.append(text)
+        if len(self.pending) >= EMBED_FLUSH:
+            self.flush()
+        return self.rows + len(self.pending) - 1
+
+    def flush(self) -> None:
+        if not self.pending:
+            return
+        V = np.asarray(self._embed(self.pending, model=self.model, backend=self.backend, parallel=True), dtype=np.float32)
+        self.dim = V.shape[1]
+        self._f.write(V.tobytes())
+        self.rows += len(self.pending)
+        self.pending = []
+
+    def close(self) -> np.ndarray:
+        self.flush()
+        self._f.close()
+        if self.rows == 0:
+            return np.empty((0, 0), dtype=np.float32)
+        return np.memmap(self.path, dtype=np.float32, mode="r", shape=(self.rows, self.dim))
+
+
+def build_kb(
+    seed: Path = SEED,
+    root: Path = KB_ROOT,
+    model: str | None = None,
+    max_words: int = 120,
+    keep: int = 3,
+    backend: str | None = None,
+) -> Path:
+    """
+    Build a new KB version incrementally and publish it. Returns its directory.
+    backend/model default to EMBED_BACKEND and that backend's default model.
+    """
+    from .gemini_client import EMBED_BACKEND, default_embed_model
+
+    root = Path(root)
+    backend = backend or EMBED_BACKEND
+    model = model or default_embed_model(backend)
+    prev_dir = current_kb_dir(root)
+    prev_rows, n_prev, prev_emb = _read_previous(prev_dir, backend, model)
+
+    version = datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+    versions = root / VERSIONS_DIR
+    versions.mkdir(parents=True, exist_ok=True)
+    stage = Path(tempfile.mkdtemp(prefix=".build-", dir=versions))
+
+    try:
+        spool = _EmbedSpool(stage / "new_vectors.f32", backend, model)
+        kept: Dict[int, Tuple[str, int | None]] = {}  # old row -> (record line, spool row if changed)
+        appended: List[int] = []                      # spool rows of brand-new chunks, in order
+        seen = set()
+        n_reused = n_changed = 0
+
+        with open(stage / "appended.jsonl", "w", encoding="utf-8") as tail:
+            for rec in iter_seed_chunks(Path(seed), max_words=max_words):
+                if rec["id"] in seen:
+                    continue
+                seen.add(rec["id"])
+                line = json.dumps(rec, ensure_ascii=False) + "\n"
+                old = prev_rows.get(rec["id"])
+                if old is None:
+                    appended.append(spool.add(rec["text"]))
+                    tail.write(line)
+                elif old[1] == rec["hash"]:
+                    kept[old[0]] = (line, None)
+                    n_reused += 1
+                else:
+                    kept[old[0]] = (line, spool.add(rec["text"]))
+                    n_changed += 1
+        fresh = spool.close()
+        n_deleted = n_prev - len(kept)
+        print(
+            f"Chunks: {n_reused} reused, {n_changed} changed, {len(appended)} new, "
+            f"{n_deleted} deleted ({spool.rows} embedded)"
+        )
+
+        # Row sources for the new matrix: surviving old rows in their old
+        # order (changed ones from the spool), then the appended rows
+        old_order = sorted(kept)
+        old_E = np.load(prev_emb, mmap_mode="r") if prev_emb is not None and old_order else None
+        dim = fresh.shape[1] if spool.rows else (old_E.shape[1] if old_E is not None else 0)
+        n_rows = len(old_order) + len(appended)
+
+        with open(stage / CHUNKS_NAME, "w", encoding="utf-8") as f:
+            for row in old_order:
+                f.write(kept[row][0])
+            with open(stage / "appended.jsonl", "r", encoding="utf-8") as tail:
+                shutil.copyfileobj(tail, f)
+
+        E = np.lib.format.open_memmap(stage / EMB_NAME, mode="w+", dtype=np.float32, shape=(n_rows, dim))
+        for start in range(0, len(old_order), COPY_BLOCK):
+            rows = old_order[start : start + COPY_BLOCK]
+            block = np.asarray(old_E[rows], dtype=np.float32)
+            for i, row in enumerate(rows):
+                if kept[row][1] is not None:
+                    block[i] = fresh[kept[row][1]]
+            E[start : start + len(rows)] = block
+        if appended:
+            E[len(old_order):] = fresh[appended]
+        E.flush()
+        del E, old_E, fresh
+
+        # Derived files: normalized store, BM25, IVF (large KBs only)
+        raw = np.load(stage / EMB_NAME, mmap_mode="r")
+        write_vectors(stage / VEC_NAME, raw)
+        del raw
+        with open(stage / CHUNKS_NAME, "r", encoding="utf-8") as f:
+            BM25Index.build(json.loads(line)["text"] for line in f).save(stage / BM25_NAME)
+        if n_rows >= ANN_MIN_ROWS:
+            build_ivf(open_vectors(stage / VEC_NAME), stage / ANN_NAME)
+
+        meta = {
+            "backend": backend,
+            "model": model,
+            "dim": int(dim),
+            "rows": int(n_rows),
+            "normalized": True,
+            "dtype": VECTOR_DTYPE,
+            "version": version,
+            "seed": str(seed),
+        }
+        (stage / META_NAME).write_text(json.dumps(meta, indent=2), encoding="utf-8")
+        for scratch in ("new_vectors.f32", "appended.jsonl"):
+            (stage / scratch).unlink()
+
+        # Publish: move the finished directory into place, then swap the pointer
+        final = versions / version
+        os.replace(stage, final)
+        with atomic_write(root / CURRENT_FILE) as f:
+            f.write(version.encode("utf-8"))
+        print(f"✅ KB version {version} published: {n_rows} rows -> {final}")
+    except BaseException:
+        shutil.rmtree(stage, ignore_errors=True)
+        raise
+
+    _prune(versions, keep)
+    return final
+
+
+def _prune(versions: Path, keep: int) -> None:
+    """Delete all but the newest `keep` published versions."""
+    published = sorted(p for p in versions.iterdir() if p.is_dir() and not p.name.startswith("."))
+    for old in published[:-keep] if keep > 0 else []:
+        shutil.rmtree(old, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Incrementally build the lecture KB")
+    ap.add_argument("--seed", type=Path, default=SEED, help="seed JSONL (id, course, topic_tags, transcript)")
+    ap.add_argument("--kb-dir", type=Path, default=KB_ROOT)
+    ap.add_argument("--backend", choices=("gemini", "hash"),
+                    help="embedding backend (default: EMBED_BACKEND env var; queries reuse it via kb_meta.json)")
+    ap.add_argument("--model", help="embedding model (default: the backend's default)")
+    ap.add_argument("--max-words", type=int, default=120, help="words per chunk")
+    ap.add_argument("--keep", type=int, default=3, help="published versions to keep")
+    args = ap.parse_args()
+    build_kb(args.seed, args.kb_dir, args.model, args.max_words, args.keep, args.backend)
@@ -0,0 +1,170 @@
+from __future__ import annotations
+import json
+import os
+import tempfile
+from contextlib import contextmanager
+from pathlib import Path
+from typing import BinaryIO, Dict, Iterator, Tuple, Union
+import numpy as np
+
+# --------------------------
+# On-disk vector store
+# --------------------------
+# The KB vectors are kept as a plain .npy file whose rows are already
+# unit-normalized. The .npy header carries dtype + shape, so the file can be
+# opened with np.load(mmap_mode="r") and shared page-cached between processes.
+
+# Versioned layout written by agents.kb_builder:
+#   <root>/versions/<version>/kb_*   one complete, immutable KB per build
+#   <root>/CURRENT                   name of the live version (swapped atomically)
+# Without a CURRENT pointer the flat files in <root> are the KB.
+CURRENT_FILE = "CURRENT"
+VERSIONS_DIR = "versions"
+
+# Files of one KB version
+CHUNKS_NAME = "kb_chunks.jsonl"   # chunk records, one per row
+EMB_NAME = "kb_embeddings.npy"    # raw embedding matrix
+VEC_NAME = "kb_vectors.npy"       # unit-normalized rows, memory-mapped
+ANN_NAME = "kb_ivf.npz"           # IVF index, used above ANN_MIN_ROWS
+BM25_NAME = "kb_bm25.npz"         # lexical inverted index
+META_NAME = "kb_meta.json"
+
+VECTOR_DTYPE = os.getenv("KB_VECTOR_DTYPE", "float32")  # float32 | float16
+BLOCK_ROWS = 65536  # rows scored per block (bounds temp memory on float16 stores)
+
+
+def current_kb_dir(root: Path) -> Path:
+    """Directory holding the live KB files under root."""
+    root = Path(root)
+    pointer = root / CURRENT_FILE
+    if pointer.exists():
+        version_dir = root / VERSIONS_DIR / pointer.read_text(encoding="utf-8").strip()
+        if version_dir.is_dir():
+            return version_dir
+    return root
+
+
+def read_meta(kb_dir: Path) -> Dict:
+    """
+    kb_meta.json of one KB version ({} if missing). KBs written before the
+    embedding backend was recorded were all built with Gemini.
+    """
+    meta_file = Path(kb_dir) / META_NAME
+    meta = json.loads(meta_file.read_text(encoding="utf-8")) if meta_file.exists() else {}
+    meta.setdefault("backend", "gemini")
+    return meta
+
+
+def normalize_rows(E: np.ndarray, dtype: Union[str, np.dtype] = VECTOR_DTYPE) -> np.ndarray:
+    """Return a copy of E with unit-length rows, cast to dtype."""
+    E = np.asarray(E, dtype=np.float32)
+    if E.ndim != 2 or len(E) == 0:
+        return E.astype(dtype)
+    norms = np.linalg.norm(E, axis=1, keepdims=True)
+    norms = np.clip(norms, 1e-12, None)
+    return (E / norms).astype(dtype)
+
+
+def normalize_query(q) -> np.ndarray:
+    """Unit-normalize one query vector (or a matrix of query rows) as float32."""
+    q = np.asarray(q, dtype=np.float32)
+    if q.ndim == 1:
+        return q / max(float(np.linalg.norm(q)), 1e-12)
+    norms = np.linalg.norm(q, axis=1, keepdims=True)
+    return q / np.clip(norms, 1e-12, None)
+
+
+@contextmanager
+def atomic_write(path: Path) -> Iterator[BinaryIO]:
+    """
+    Write path atomically: the data goes to a uniquely named temp file in the
+    same directory, which replaces path only once it is complete. Concurrent
+    writers (e.g. two app processes rebuilding the same store) never share a
+    temp file, and readers that already mapped the old file keep it.
+    """
+    path = Path(path)
+    fd, tmp = tempfile.mkstemp(prefix=f".{path.name}.", suffix=".tmp", dir=path.parent)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            yield f
+        os.chmod(tmp, 0o644)  # mkstemp files are private; published KB files are not
+        os.replace(tmp, path)
+    except BaseException:
+        Path(tmp).unlink(missing_ok=True)
+        raise
+
+
+def write_vectors(path: Path, E: np.ndarray, dtype: Union[str, np.dtype] = VECTOR_DTYPE) -> Path:
+    """Normalize E and write it to path atomically (see atomic_write)."""
+    path = Path(path)
+    with atomic_write(path) as f:
+        np.save(f, normalize_rows(E, dtype))
+    return path
+
+
+def open_vectors(path: Path) -> np.ndarray:
+    """Open a normalized vector file read-only and memory-mapped."""
+    return np.load(Path(path), mmap_mode="r")
+
+
+def _is_fresh(raw_file: Path, vec_file: Path) -> bool:
+    """vec_file was converted from the current raw_file: newer and the same shape"""
+    if not vec_file.exists():
+        return False
+    if not raw_file.exists():
+        return True
+    if vec_file.stat().st_mtime < raw_file.stat().st_mtime:
+        return False
+    try:
+        return open_vectors(vec_file).shape == np.load(raw_file, mmap_mode="r").shape
+    except (OSError, ValueError):
+        return False
+
+
+def ensure_vectors(raw_file: Path, vec_file: Path, dtype: Union[str, np.dtype] = VECTOR_DTYPE) -> Path:
+    """
+    Make sure vec_file exists and matches raw_file (newer, same shape),
+    converting the raw embedding matrix once if needed. The store is a
+    derived file, never committed: the first load builds it. Returns the
+    path to the normalized store.
+    """
+    raw_file, vec_file = Path(raw_file), Path(vec_file)
+    if _is_fresh(raw_file, vec_file):
+        return vec_file
+    print(f"Converting {raw_file.name} -> {vec_file.name} ({dtype}, unit rows)")
+    return write_vectors(vec_file, np.load(raw_file), dtype)
+
+
+def dot_rows(E: np.ndarray, q: np.ndarray, block: int = BLOCK_ROWS) -> np.ndarray:
+    """
+    Score every row of E against q (1-D query or 2-D query matrix) as float32.
+    float32 stores are scored with one product; float16 stores are upcast
+    block by block so a large mapped matrix is never copied whole into RAM.
+    """
+    q = np.asarray(q, dtype=np.float32)
+    if E.dtype == np.float32:
+        return E @ q.T
+    out = np.empty((len(E),) + q.shape[:-1], dtype=np.float32)
+    for start in range(0, len(E), block):
+        out[start : start + block] = np.asarray(E[start : start + block], dtype=np.float32) @ q.T
+    return out
+
+
+def topk(scores: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Top-k along the last axis, best first: np.argpartition then a sort of
+    only the k survivors. Works on a 1-D score vector or an (m, n) matrix.
+    Returns (indices, scores).
+    """
+    n = scores.shape[-1]
+    k = min(k, n)
+    if k <= 0:
+        empty = np.empty(scores.shape[:-1] + (0,), dtype=np.int64)
+        return empty, empty.astype(np.float32)
+    if k < n:
+        part = np.argpartition(-scores, k - 1, axis=-1)[..., :k]
+    else:
+        part = np.broadcast_to(np.arange(n), scores.shape).copy()
+    part_scores = np.take_along_axis(scores, part, axis=-1)
+    order = np.argsort(-part_scores, axis=-1, kind="stable")
+    return np.take_along_axis(part, order, axis=-1), np.take_along_axis(part_scores, order, axis=-1)
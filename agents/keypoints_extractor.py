@@ -1,10 +1,12 @@
 from __future__ import annotations
 from pathlib import Path
-from typing import Dict, Any
+from typing import Dict, Any, Optional, Sequence
 from pydantic import BaseModel
 import json
 
-from .gemini_client import gen_text
+from .gemini_client import MODEL, gen_text
+from .context_packer import PROMPT_TOKEN_BUDGET, pack_context
+from .stage_cache import digest, load_stage, save_stage, stage_key
 from utils.fs import DATA_PROC, ts
 
 # --------------------------
@@ -46,20 +48,39 @@ Guidelines:
 - DO NOT include any text outside the JSON schema.
 """
 
+# Prompt, model and schema shape the outline (stage cache key)
+OUTLINE_STAGE_VERSION = digest(SYS_PROMPT, MODEL, pydantic_to_schema(Outline))
+
 # --------------------------
 # Extract Outline
 # --------------------------
-def extract_outline(cleaned_transcript: str) -> tuple[Outline, Path]:
+def extract_outline(
+    cleaned_transcript: str,
+    kb_hits: Optional[Sequence] = None,
+    token_budget: int = PROMPT_TOKEN_BUDGET,
+    cache: Optional[bool] = None,
+) -> tuple[Outline, Path]:
     """
     Extracts a structured outline (JSON) from the cleaned transcript.
+    kb_hits (retriever.hybrid_retrieve results) are packed in as supporting
+    context within the token budget (see context_packer.pack_context).
+    An outline already extracted from the same packed prompt is reused from
+    the stage cache (cache=False forces a new one).
     Returns the Outline object and the saved JSON path.
     """
     schema = pydantic_to_schema(Outline)
 
-    prompt = (
-        "Create an outline from the following transcript:\n\n"
-        + cleaned_transcript[:120000]  # clip to avoid token overflow
-    )
+    packed = pack_context(cleaned_transcript, kb_hits, budget=token_budget)
+    prompt = "Create an outline from the following transcript:\n\n" + packed.text
+
+    key = stage_key("outline", OUTLINE_STAGE_VERSION, digest(prompt))
+    hit = load_stage(key, cache)
+    if hit is not None:
+        outline, out_path = Outline.model_validate(hit["outline"]), Path(hit["path"])
+        if not out_path.exists():
+            out_path = DATA_PROC / f"outline_{ts()}.json"
+            out_path.write_text(outline.model_dump_json(indent=2), encoding="utf-8")
+        return outline, out_path
 
     resp = gen_text(
         prompt,
@@ -81,5 +102,6 @@ def extract_outline(cleaned_transcript: str) -> tuple[Outline, Path]:
 
     out_path = DATA_PROC / f"outline_{ts()}.json"
     out_path.write_text(outline.model_dump_json(indent=2), encoding="utf-8")
+    save_stage(key, {"outline": outline.model_dump(), "path": str(out_path)}, cache)
 
     return outline, out_path
@@ -0,0 +1,65 @@
+from __future__ import annotations
+import math
+import zlib
+from collections import Counter
+from typing import List
+import numpy as np
+
+from .bm25 import tokenize
+
+# --------------------------
+# Hashed n-gram embeddings (in-process, no network)
+# --------------------------
+# Each text becomes a bag of word unigrams, word bigrams and character
+# trigrams. Every feature is hashed (crc32) to one of `dim` buckets with a
+# hash-derived sign, weighted by sublinear tf, and the row is L2-normalized,
+# so cosine similarity behaves like a TF-IDF-style lexical overlap score.
+# Deterministic across processes and machines: the KB builder and the
+# retriever only need to agree on the model name.
+HASH_MODEL_PREFIX = "hash-ngram-"
+DEFAULT_HASH_DIM = 768
+
+# Relative weight of each feature family
+WORD_WEIGHT = 1.0
+BIGRAM_WEIGHT = 0.7
+TRIGRAM_WEIGHT = 0.3
+
+
+def hash_model(dim: int = DEFAULT_HASH_DIM) -> str:
+    """Model name recorded in kb_meta.json for a hashed backend of `dim` buckets."""
+    return f"{HASH_MODEL_PREFIX}{dim}"
+
+
+def hash_dim(model: str) -> int:
+    """Bucket count encoded in a hashed model name (e.g. hash-ngram-768 -> 768)."""
+    if not model.startswith(HASH_MODEL_PREFIX):
+        raise ValueError(f"Not a hashed embedding model: {model}")
+    return int(model[len(HASH_MODEL_PREFIX):])
+
+
+def _features(text: str) -> Counter:
+    words = tokenize(text)
+    feats: Counter = Counter()
+    for w in words:
+        feats["w:" + w] += WORD_WEIGHT
+        padded = f"<{w}>"
+        for i in range(len(padded) - 2):
+            feats["c:" + padded[i : i + 3]] += TRIGRAM_WEIGHT
+    for a, b in zip(words, words[1:]):
+        feats["b:" + a + " " + b] += BIGRAM_WEIGHT
+    return feats
+
+
+def hash_embed(texts: List[str], dim: int = DEFAULT_HASH_DIM) -> np.ndarray:
+    """Embed texts into unit-normalized float32 rows of shape (len(texts), dim)."""
+    out = np.zeros((len(texts), dim), dtype=np.float32)
+    for row, text in enumerate(texts):
+        feats = _features(text)
+        if not feats:
+            continue
+        h = np.fromiter((zlib.crc32(f.encode("utf-8")) for f in feats), dtype=np.uint32, count=len(feats))
+        w = np.fromiter((1.0 + math.log(v) if v >= 1 else v for v in feats.values()), dtype=np.float32, count=len(feats))
+        sign = np.where(h & 0x80000000, -1.0, 1.0).astype(np.float32)
+        out[row] = np.bincount(h % dim, weights=w * sign, minlength=dim)
+    norms = np.linalg.norm(out, axis=1, keepdims=True)
+    return out / np.clip(norms, 1e-12, None)
@@ -0,0 +1,98 @@
+from __future__ import annotations
+import os
+import shutil
+import subprocess
+import wave
+from pathlib import Path
+from typing import Iterable
+
+# --------------------------
+# Media preparation
+# --------------------------
+# Speech needs neither video, stereo nor 44.1/48 kHz: recordings are decoded
+# once (audio track only), downmixed to mono, resampled to a speech rate and
+# encoded compactly before anything is uploaded. The downmix happens while
+# decoding (inside ffmpeg, or block by block for WAV), so a long recording
+# is never held in memory as full-rate stereo PCM. Encoding needs ffmpeg; when
+# the encoder is unavailable the speech-rate audio is written as WAV, which
+# is still several times smaller than the original PCM.
+SPEECH_SAMPLE_RATE = int(os.getenv("MEDIA_SAMPLE_RATE", "16000"))
+SPEECH_FORMAT = os.getenv("MEDIA_FORMAT", "mp3")
+SPEECH_BITRATE = os.getenv("MEDIA_BITRATE", "32k")
+WAV_CHUNK_S = 60  # seconds converted per block when reading WAV without ffmpeg
+
+
+class AudioDecodeError(RuntimeError):
+    """The recording could not be decoded locally (e.g. ffmpeg missing)."""
+
+
+def _decode_ffmpeg(ffmpeg: str, path: str):
+    """ffmpeg drops the video and downmixes / resamples while decoding (16-bit mono PCM out)."""
+    from pydub import AudioSegment
+
+    proc = subprocess.run(
+        [ffmpeg, "-nostdin", "-v", "error", "-i", path,
+         "-vn", "-ac", "1", "-ar", str(SPEECH_SAMPLE_RATE), "-f", "s16le", "-"],
+        capture_output=True,
+    )
+    if proc.returncode != 0 or not proc.stdout:
+        raise AudioDecodeError(f"{Path(path).name}: {proc.stderr.decode(errors='ignore').strip()[-300:]}")
+    return AudioSegment(data=proc.stdout, sample_width=2, frame_rate=SPEECH_SAMPLE_RATE, channels=1)
+
+
+def _decode_wav(path: str):
+    """Without ffmpeg: WAV converted in WAV_CHUNK_S blocks, never held at full rate."""
+    from pydub import AudioSegment
+
+    with wave.open(path, "rb") as w:
+        width, channels, rate = w.getsampwidth(), w.getnchannels(), w.getframerate()
+        out_rate = min(rate, SPEECH_SAMPLE_RATE)
+        pcm = bytearray()
+        while True:
+            frames = w.readframes(rate * WAV_CHUNK_S)
+            if not frames:
+                break
+            block = AudioSegment(data=frames, sample_width=width, frame_rate=rate, channels=channels)
+            pcm += block.set_channels(1).set_frame_rate(out_rate).set_sample_width(2).raw_data
+    return AudioSegment(data=bytes(pcm), sample_width=2, frame_rate=out_rate, channels=1)
+
+
+def load_speech(path: str):
+    """Decode the audio track of an audio/video file as mono SPEECH_SAMPLE_RATE audio."""
+    ffmpeg = shutil.which("ffmpeg") or shutil.which("avconv")
+    try:
+        if ffmpeg:
+            return _decode_ffmpeg(ffmpeg, path)
+        if Path(path).suffix.lower() == ".wav":
+            return _decode_wav(path)
+    except AudioDecodeError:
+        raise
+    except Exception as e:
+        raise AudioDecodeError(f"{Path(path).name}: {e}") from e
+    raise AudioDecodeError(f"{Path(path).name}: ffmpeg not found")
+
+
+def export_speech(audio, dest: Path) -> Path:
+    """Write audio as SPEECH_FORMAT (or WAV without an encoder); returns the written path."""
+    dest = Path(dest).with_suffix("." + SPEECH_FORMAT)
+    try:
+        audio.export(dest, format=SPEECH_FORMAT, bitrate=SPEECH_BITRATE)
+        return dest
+    except Exception as e:
+        dest.unlink(missing_ok=True)
+        if SPEECH_FORMAT == "wav":
+            raise
+        fallback = dest.with_suffix(".wav")
+        print(f"⚠️ Could not encode {SPEECH_FORMAT} ({e.__class__.__name__}); writing WAV instead")
+        audio.export(fallback, format="wav")
+        return fallback
+
+
+def report_savings(source: Path, prepared: Iterable[Path]) -> int:
+    """Log and return the bytes saved by uploading `prepared` instead of `source`."""
+    before = Path(source).stat().st_size
+    after = sum(Path(p).stat().st_size for p in prepared)
+    saved = before - after
+    print(f"🎧 Prepared {Path(source).name}: {before / 2**20:.1f} MB -> {after / 2**20:.1f} MB "
+          f"({saved / 2**20:.1f} MB saved, {saved / max(before, 1):.0%})")
+    return saved
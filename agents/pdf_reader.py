@@ -0,0 +1,61 @@
+from __future__ import annotations
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from typing import Iterator, List
+
+# --------------------------
+# Page-parallel PDF text extraction
+# --------------------------
+# pypdf is pure Python, so extraction is CPU-bound on one core. Larger
+# documents are split into page ranges that worker processes parse
+# independently (each opens the file itself); pages are still yielded in
+# order, as soon as the range holding them is done.
+PDF_WORKERS = int(os.getenv("PDF_WORKERS", str(min(4, os.cpu_count() or 1))))
+PDF_PAGES_PER_TASK = 16
+
+
+def _extract_range(path: str, start: int, stop: int) -> List[str]:
+    """Worker: text of pages [start, stop)."""
+    from pypdf import PdfReader
+
+    reader = PdfReader(path)
+    return [reader.pages[i].extract_text() or "" for i in range(start, stop)]
+
+
+def page_count(path: str) -> int:
+    from pypdf import PdfReader
+
+    return len(PdfReader(path).pages)
+
+
+def iter_pdf_pages(path: Path, workers: int = PDF_WORKERS, pages_per_task: int = PDF_PAGES_PER_TASK) -> Iterator[str]:
+    """Yield the text of every page in order, parsing page ranges in parallel."""
+    path = str(path)
+    n = page_count(path)
+    if workers <= 1 or n <= pages_per_task:
+        yield from _extract_range(path, 0, n)
+        return
+
+    # spawn: the app may be multi-threaded, and workers only need pypdf
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as pool:
+        futures = [
+            pool.submit(_extract_range, path, start, min(n, start + pages_per_task))
+            for start in range(0, n, pages_per_task)
+        ]
+        done = 0
+        try:
+            for fut in futures:
+                pages = fut.result()
+                done += len(pages)
+                yield from pages
+        except BrokenProcessPool as e:
+            # Workers could not start or died: finish in this process
+            print(f"⚠️ PDF worker pool failed ({e}); extracting the remaining pages sequentially")
+            yield from _extract_range(path, done, n)
+        finally:
+            for fut in futures:
+                fut.cancel()
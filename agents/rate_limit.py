@@ -0,0 +1,216 @@
+from __future__ import annotations
+import asyncio
+import os
+import random
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, TypeVar
+
+T = TypeVar("T")
+
+# --------------------------
+# Settings
+# --------------------------
+GEMINI_RPM = float(os.getenv("GEMINI_RPM", "60"))               # generate_content requests / minute
+GEMINI_TPM = float(os.getenv("GEMINI_TPM", "1000000"))          # generate_content tokens / minute
+GEMINI_EMBED_RPM = float(os.getenv("GEMINI_EMBED_RPM", "1500")) # embed_content requests / minute
+MAX_RETRIES = int(os.getenv("GEMINI_MAX_RETRIES", "5"))
+DEADLINE_S = float(os.getenv("GEMINI_DEADLINE_S", "300"))       # per call, including waits and retries
+BACKOFF_BASE_S = 1.0
+BACKOFF_CAP_S = 32.0
+
+RETRYABLE_CODES = frozenset({408, 429, 500, 502, 503, 504})
+
+
+class DeadlineExceeded(TimeoutError):
+    """A call could not be admitted or completed before its deadline."""
+
+
+# --------------------------
+# Token buckets
+# --------------------------
+class TokenBucket:
+    """
+    Refills at `per_minute / 60` units per second up to `capacity` (one
+    minute's worth by default). Reservations may drive the level negative:
+    the caller is told how long to wait for its share, so waiting callers
+    are served in reservation order.
+    """
+
+    def __init__(self, per_minute: float, capacity: Optional[float] = None):
+        self.rate = per_minute / 60.0
+        self.capacity = capacity if capacity is not None else per_minute
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        self._refill(now)
+        # Requests larger than the bucket are admitted once it is full
+        amount = min(amount, self.capacity)
+        return max(0.0, (amount - self.level) / self.rate) if self.rate > 0 else 0.0
+
+    def take(self, amount: float) -> None:
+        self.level -= min(amount, self.capacity)
+
+    def give_back(self, amount: float) -> None:
+        self.level = min(self.capacity, self.level + amount)
+
+
+class RateLimiter:
+    """
+    Requests-per-minute + tokens-per-minute limiter shared by all threads
+    (and event loops) of the process, with counters for monitoring.
+    """
+
+    def __init__(self, name: str, rpm: float, tpm: Optional[float] = None):
+        self.name = name
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm) if tpm else None
+        self._lock = threading.Lock()
+        self.counters: Dict[str, float] = {
+            "calls": 0, "throttled": 0, "throttle_wait_s": 0.0, "retried": 0, "failed": 0,
+        }
+
+    def reserve(self, tokens: int = 0, deadline: Optional[float] = None) -> float:
+        """
+        Claim one request (+ `tokens`) and return the seconds to wait before
+        sending it. Raises DeadlineExceeded (claiming nothing) if that wait
+        would end after `deadline` (a time.monotonic() value).
+        """
+        with self._lock:
+            now = time.monotonic()
+            wait = self.requests.wait_time(1, now)
+            if self.tokens is not None and tokens:
+                wait = max(wait, self.tokens.wait_time(tokens, now))
+            if deadline is not None and now + wait > deadline:
+                raise DeadlineExceeded(f"{self.name}: rate limit wait of {wait:.1f}s exceeds the deadline")
+            self.requests.take(1)
+            if self.tokens is not None and tokens:
+                self.tokens.take(tokens)
+            self.counters["calls"] += 1
+            if wait > 0:
+                self.counters["throttled"] += 1
+                self.counters["throttle_wait_s"] += wait
+            return wait
+
+    def settle(self, estimated: int, actual: Optional[int]) -> None:
+        """Correct the token bucket once the real usage of a call is known."""
+        if self.tokens is None or actual is None:
+            return
+        with self._lock:
+            if actual > estimated:
+                self.tokens.take(actual - estimated)
+            else:
+                self.tokens.give_back(estimated - actual)
+
+    def count(self, counter: str) -> None:
+        with self._lock:
+            self.counters[counter] += 1
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            return dict(self.counters)
+
+
+GENERATE_LIMITER = RateLimiter("generate", GEMINI_RPM, GEMINI_TPM)
+EMBED_LIMITER = RateLimiter("embed", GEMINI_EMBED_RPM)
+
+
+def rate_limit_stats() -> Dict[str, Dict[str, float]]:
+    """Throttled / retried / failed counters per limiter."""
+    return {lim.name: lim.stats() for lim in (GENERATE_LIMITER, EMBED_LIMITER)}
+
+
+# --------------------------
+# Retry with jittered exponential backoff
+# --------------------------
+def is_retryable(exc: BaseException) -> bool:
+    """Quota (429), timeouts and transient 5xx / transport errors are retried."""
+    code = getattr(exc, "code", None)
+    if isinstance(code, int):
+        return code in RETRYABLE_CODES
+    if isinstance(exc, (ConnectionError, TimeoutError)) and not isinstance(exc, DeadlineExceeded):
+        return True
+    try:
+        import httpx
+    except ImportError:
+        return False
+    return isinstance(exc, httpx.TransportError)
+
+
+def backoff_delay(attempt: int) -> float:
+    """Full-jitter exponential backoff: uniform(0, min(cap, base * 2**attempt))."""
+    return random.uniform(0, min(BACKOFF_CAP_S, BACKOFF_BASE_S * 2 ** attempt))
+
+
+def _usage(result: Any) -> Optional[int]:
+    usage = getattr(result, "usage_metadata", None)
+    return getattr(usage, "total_token_count", None) if usage is not None else None
+
+
+def _next_delay(limiter: Optional[RateLimiter], exc: Exception, attempt: int, retries: int, deadline: float) -> float:
+    """Backoff before the next attempt, or re-raise if out of retries/time."""
+    if not is_retryable(exc) or attempt >= retries:
+        if limiter is not None:
+            limiter.count("failed")
+        raise exc
+    delay = backoff_delay(attempt)
+    if time.monotonic() + delay > deadline:
+        if limiter is not None:
+            limiter.count("failed")
+        raise DeadlineExceeded(f"gave up after {attempt + 1} attempts: {exc}") from exc
+    if limiter is not None:
+        limiter.count("retried")
+    print(f"⚠️ Gemini call failed ({exc.__class__.__name__}: {getattr(exc, 'code', '')}); "
+          f"retry {attempt + 1}/{retries} in {delay:.1f}s")
+    return delay
+
+
+def call_with_retry(
+    fn: Callable[[], T],
+    limiter: Optional[RateLimiter] = None,
+    tokens: int = 0,
+    retries: int = MAX_RETRIES,
+    deadline_s: float = DEADLINE_S,
+) -> T:
+    """Run fn() under the limiter, retrying transient failures until the deadline."""
+    deadline = time.monotonic() + deadline_s
+    for attempt in range(retries + 1):
+        if limiter is not None:
+            time.sleep(limiter.reserve(tokens, deadline))
+        try:
+            result = fn()
+        except Exception as e:
+            time.sleep(_next_delay(limiter, e, attempt, retries, deadline))
+            continue
+        if limiter is not None:
+            limiter.settle(tokens, _usage(result))
+        return result
+    raise AssertionError("unreachable")
+
+
+async def acall_with_retry(
+    fn: Callable[[], Awaitable[T]],
+    limiter: Optional[RateLimiter] = None,
+    tokens: int = 0,
+    retries: int = MAX_RETRIES,
+    deadline_s: float = DEADLINE_S,
+) -> T:
+    """Awaitable call_with_retry; waits with asyncio.sleep instead of blocking."""
+    deadline = time.monotonic() + deadline_s
+    for attempt in range(retries + 1):
+        if limiter is not None:
+            await asyncio.sleep(limiter.reserve(tokens, deadline))
+        try:
+            result = await fn()
+        except Exception as e:
+            await asyncio.sleep(_next_delay(limiter, e, attempt, retries, deadline))
+            continue
+        if limiter is not None:
+            limiter.settle(tokens, _usage(result))
+        return result
+    raise AssertionError("unreachable")
@@ -1,176 +1,545 @@
 from __future__ import annotations
+from concurrent.futures import ThreadPoolExecutor, wait
 from pathlib import Path
 import json
+import os
+import threading
 import numpy as np
 from typing import List, Dict, Tuple, Optional
+from pydantic import BaseModel
 from .gemini_client import embed_texts  # ✅ Correct import
+from .ann_index import ANN_MIN_ROWS, ANN_NPROBE, IVFIndex
+from .bm25 import BM25Index
+from .stage_cache import digest, load_stage, save_stage, stage_key
+from .kb_store import (
+    ANN_NAME, BM25_NAME, CHUNKS_NAME, EMB_NAME, VEC_NAME,
+    current_kb_dir, dot_rows, ensure_vectors, normalize_query, normalize_rows, open_vectors, read_meta, topk,
+)
+from utils.text import word_windows
 
-KB_DIR = Path("data/kb")
-CHUNKS = KB_DIR / "kb_chunks.jsonl"
-EMB_FILE = KB_DIR / "kb_embeddings.npy"
-META = KB_DIR / "kb_meta.json"
+KB_ROOT = Path("data/kb")  # live version resolved via kb_store.current_kb_dir
 
-def _load_kb():
+# Segmented retrieval for long transcripts
+SEGMENT_WORDS = 200   # words per query window
+SEGMENT_OVERLAP = 40  # words shared by neighbouring windows
+MAX_SEGMENTS = 64     # cap on windows embedded per transcript
+RRF_K = 60            # reciprocal-rank-fusion damping constant
+
+# Hybrid dense + lexical retrieval
+HYBRID_FUSION = os.getenv("HYBRID_FUSION", "rrf")  # rrf | weighted
+HYBRID_ALPHA = float(os.getenv("HYBRID_ALPHA", "0.5"))  # dense weight for "weighted"
+HYBRID_DEPTH = 3  # candidates per path = k * HYBRID_DEPTH
+RETRIEVAL_BUDGET_S = float(os.getenv("RETRIEVAL_BUDGET_S", "10"))
+
+# MMR diversification of the final top-k
+MMR_LAMBDA = float(os.getenv("MMR_LAMBDA", "0.7"))                  # 1.0 = pure relevance
+MMR_MAX_PER_PARENT = int(os.getenv("MMR_MAX_PER_PARENT", "2"))      # 0 = no per-lecture cap
+MMR_DEPTH = 3  # candidates re-ranked = k * MMR_DEPTH
+
+def _read_chunks(chunks_file: Path) -> List[Dict]:
+    """Read kb_chunks.jsonl (one chunk per line)"""
+    chunks = []
+    with open(chunks_file, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                chunks.append(json.loads(line.strip()))
+    return chunks
+
+def _load_kb(kb_dir: Path):
     """Safely load KB data with proper error handling"""
+    chunks_file, emb_file, vec_file = kb_dir / CHUNKS_NAME, kb_dir / EMB_NAME, kb_dir / VEC_NAME
     try:
-        if not CHUNKS.exists():
+        if not chunks_file.exists():
             print("KB chunks file not found")
-            return [], np.array([]), np.array([])
+            return [], np.array([])
         
-        if not EMB_FILE.exists():
+        if not vec_file.exists() and not emb_file.exists():
             print("KB embeddings file not found")
-            return [], np.array([]), np.array([])
+            return [], np.array([])
         
         # Load chunks
-        chunks = []
-        with open(CHUNKS, "r", encoding="utf-8") as f:
-            for line in f:
-                chunks.append(json.loads(line.strip()))
+        chunks = _read_chunks(chunks_file)
         
-        # Load embeddings safely
-        E = np.load(EMB_FILE)
+        # Open the normalized store memory-mapped (converted once from the
+        # raw matrix if it is missing or stale)
+        try:
+            E = open_vectors(ensure_vectors(emb_file, vec_file))
+        except OSError as e:
+            # Read-only checkout: normalize in memory instead
+            print(f"⚠️ Could not write {vec_file.name} ({e}); normalizing in memory")
+            E = normalize_rows(np.load(emb_file))
         print(f"Loaded embeddings shape: {E.shape}, dtype: {E.dtype}")
         
-        # Convert to float32 if needed
-        if E.dtype != np.float32:
-            E = E.astype(np.float32)
-        
-        # Precompute norms safely
-        if len(E) > 0:
-            norms = np.linalg.norm(E, axis=1, keepdims=True)
-            norms = np.clip(norms, 1e-12, None)
-        else:
-            norms = np.array([])
-            
         print(f"✅ Loaded {len(chunks)} chunks, {len(E)} embeddings")
-        return chunks, E, norms
+        return chunks, E
         
     except Exception as e:
         print(f"❌ Error loading KB: {e}")
-        return [], np.array([]), np.array([])
+        return [], np.array([])
+
+def _load_ann(kb_dir: Path, n_rows: int) -> Optional[IVFIndex]:
+    """Load the IVF index when the KB is large enough for it to pay off"""
+    ann_file = kb_dir / ANN_NAME
+    if n_rows < ANN_MIN_ROWS or not ann_file.exists():
+        return None
+    try:
+        index = IVFIndex.load(ann_file)
+        if index.rows != n_rows:
+            print(f"⚠️ {ann_file.name} is stale ({index.rows} rows vs {n_rows}); using exact search")
+            return None
+        print(f"✅ Loaded IVF index with {index.nlist} lists (nprobe={ANN_NPROBE})")
+        return index
+    except Exception as e:
+        print(f"❌ Error loading IVF index: {e}")
+        return None
+
+def _load_bm25(kb_dir: Path, chunks: List[Dict]) -> Optional[BM25Index]:
+    """
+    Load the persisted BM25 index, rebuilding it from the chunks if it is
+    missing, stale or unreadable (the keyword path must never silently
+    disappear). The index is a derived file, never committed.
+    """
+    bm25_file = kb_dir / BM25_NAME
+    if not chunks:
+        return None
+    if bm25_file.exists() and bm25_file.stat().st_mtime >= (kb_dir / CHUNKS_NAME).stat().st_mtime:
+        try:
+            index = BM25Index.load(bm25_file)
+            if index.n_docs == len(chunks):
+                return index
+            print(f"⚠️ {bm25_file.name} is stale ({index.n_docs} docs vs {len(chunks)} chunks); rebuilding")
+        except Exception as e:
+            print(f"⚠️ Could not load {bm25_file.name} ({e}); rebuilding")
+    index = BM25Index.build([c.get("text", "") for c in chunks])
+    try:
+        index.save(bm25_file)
+        print(f"✅ Built BM25 index over {index.n_docs} chunks ({len(index.vocab)} terms)")
+    except OSError as e:
+        print(f"⚠️ Could not write {bm25_file.name}: {e}")
+    return index
+
+def _build_facets(chunks: List[Dict]) -> Tuple[Dict[str, np.ndarray], Dict[str, np.ndarray]]:
+    """Precompute sorted row ids per course and per topic tag"""
+    courses: Dict[str, List[int]] = {}
+    tags: Dict[str, List[int]] = {}
+    for row, chunk in enumerate(chunks):
+        courses.setdefault(chunk.get("course", "Unknown"), []).append(row)
+        for tag in chunk.get("topic_tags", []):
+            tags.setdefault(tag.lower(), []).append(row)
+    as_arrays = lambda d: {key: np.array(rows, dtype=np.int64) for key, rows in d.items()}
+    return as_arrays(courses), as_arrays(tags)
+
+# --------------------------
+# KB handle (loaded on first use)
+# --------------------------
+class KnowledgeBase:
+    """One loaded KB version: chunks, memory-mapped vectors and indexes"""
+
+    def __init__(self, kb_dir: Path):
+        self.dir = kb_dir
+        meta = read_meta(kb_dir)
+        # Queries must be embedded exactly like the KB rows were
+        self.embed_backend, self.embed_model = meta["backend"], meta.get("model")
+        # Identifies this build (stage cache keys); flat legacy KBs use file stamps
+        self.version = meta.get("version") or digest(
+            str(kb_dir), [p.stat().st_mtime_ns for p in sorted(kb_dir.glob("*")) if p.is_file()]
+        )
+        self.chunks, self.E = _load_kb(kb_dir)
+        self.ann = _load_ann(kb_dir, len(self.E))
+        # The lexical fallback must work even when the embeddings failed to load
+        chunks_file = kb_dir / CHUNKS_NAME
+        self.lex_chunks = self.chunks or (_read_chunks(chunks_file) if chunks_file.exists() else [])
+        self.bm25 = _load_bm25(kb_dir, self.lex_chunks)
+        # Metadata scopes (per-course / per-tag row sets)
+        self.course_rows, self.tag_rows = _build_facets(self.lex_chunks)
+        # Parent lecture of every row as a small int code (MMR per-parent cap)
+        parents: Dict[str, int] = {}
+        self.parent_codes = np.array(
+            [parents.setdefault(c.get("parent_id") or c.get("id", str(i)), len(parents))
+             for i, c in enumerate(self.lex_chunks)],
+            dtype=np.int64,
+        )
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        """Embed query texts with the backend/model this KB was built with"""
+        return embed_texts(texts, model=self.embed_model, backend=self.embed_backend)
+
+    def list_courses(self) -> List[str]:
+        return sorted(self.course_rows)
+
+    def scope_rows(self, course: Optional[str] = None, tags: Optional[List[str]] = None) -> Optional[np.ndarray]:
+        """
+        Row ids matching a course and/or any of the tags (None = whole KB).
+        An unknown course or tag yields an empty scope.
+        """
+        rows = None
+        if course:
+            rows = self.course_rows.get(course, np.empty(0, dtype=np.int64))
+        if tags:
+            tag_rows = [self.tag_rows[t.lower()] for t in tags if t.lower() in self.tag_rows]
+            tag_rows = np.unique(np.concatenate(tag_rows)) if tag_rows else np.empty(0, dtype=np.int64)
+            rows = tag_rows if rows is None else np.intersect1d(rows, tag_rows, assume_unique=True)
+        return rows
+
+    def scope_view(self, rows: np.ndarray) -> np.ndarray:
+        """The KB rows of a scope: a zero-copy slice when contiguous, else a gather"""
+        if len(rows) and rows[-1] - rows[0] + 1 == len(rows):
+            return self.E[rows[0] : rows[-1] + 1]
+        return self.E[rows]
 
-_CHUNKS, _E, _NORMS = _load_kb()
+    def topk_many(
+        self, query_vecs, k: int = 8, exact: bool = False, rows: Optional[np.ndarray] = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Top-k for a batch of query vectors: one matrix-matrix product against the
+        normalized KB, then np.argpartition + a small sort per query.
+        `rows` (see scope_rows) restricts scoring to that slice of the matrix.
+        Returns (indices, cosine scores), each of shape (n_queries, <=k).
+        """
+        Q = normalize_query(np.atleast_2d(np.asarray(query_vecs, dtype=np.float32)))
+        
+        # Scoped search only touches the scope's rows
+        if rows is not None:
+            idx, scores = topk(dot_rows(self.scope_view(rows), Q).T, k)
+            return rows[idx], scores
+        
+        # Large KBs go through the IVF index unless exact search is requested
+        if self.ann is not None and not exact:
+            hits = [self.ann.search(self.E, q, k=k) for q in Q]
+            width = min(len(ids) for ids, _ in hits)
+            return (
+                np.array([ids[:width] for ids, _ in hits]),
+                np.array([sc[:width] for _, sc in hits]),
+            )
+        
+        # Rows are stored unit-normalized, so cosine is a single product: (n_queries, n_rows)
+        sims = dot_rows(self.E, Q).T
+        return topk(sims, k)
+
+_KB_LOCK = threading.Lock()
+_KB_CACHE: Dict[Path, KnowledgeBase] = {}
+
+def get_kb() -> KnowledgeBase:
+    """
+    The live KB, loaded on first use (nothing is read at import time) and
+    reloaded when kb_builder publishes a new version.
+    """
+    kb_dir = current_kb_dir(KB_ROOT)
+    with _KB_LOCK:
+        kb = _KB_CACHE.get(kb_dir)
+        if kb is None:
+            _KB_CACHE.clear()
+            kb = _KB_CACHE[kb_dir] = KnowledgeBase(kb_dir)
+    return kb
 
-def cosine_topk(query_vec: np.ndarray, k: int = 8) -> List[int]:
+def list_courses() -> List[str]:
+    """Courses present in the KB, for scoping retrieval"""
+    return get_kb().list_courses()
+
+def scope_rows(course: Optional[str] = None, tags: Optional[List[str]] = None) -> Optional[np.ndarray]:
+    """Row ids of the KB matching a course and/or tags (None = whole KB)"""
+    return get_kb().scope_rows(course, tags)
+
+def topk_many(
+    query_vecs, k: int = 8, exact: bool = False, rows: Optional[np.ndarray] = None
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Batched top-k against the live KB (see KnowledgeBase.topk_many)"""
+    return get_kb().topk_many(query_vecs, k=k, exact=exact, rows=rows)
+
+def cosine_topk(
+    query_vec: np.ndarray,
+    k: int = 8,
+    exact: bool = False,
+    course: Optional[str] = None,
+    tags: Optional[List[str]] = None,
+) -> List[int]:
     """Find top-k most similar chunks using cosine similarity"""
-    if len(_E) == 0 or len(_CHUNKS) == 0:
+    kb = get_kb()
+    if len(kb.E) == 0 or len(kb.chunks) == 0:
         print("❌ No embeddings or chunks available")
         return []
     
     try:
-        # Ensure query_vec is proper format
-        if isinstance(query_vec, list):
-            query_vec = np.array(query_vec, dtype=np.float32)
-        
-        q = query_vec.reshape(1, -1)
-        qn = np.linalg.norm(q, axis=1, keepdims=True)
-        qn = np.clip(qn, 1e-12, None)
-        
-        # Compute cosine similarities
-        if len(_NORMS) > 0:
-            sims = (_E @ q.T) / (_NORMS * qn)
-        else:
-            # Fallback: compute norms on the fly
-            E_norms = np.linalg.norm(_E, axis=1, keepdims=True)
-            E_norms = np.clip(E_norms, 1e-12, None)
-            sims = (_E @ q.T) / (E_norms * qn)
-        
-        sims = sims.squeeze()
-        
-        # Get top-k indices
-        idx = np.argsort(-sims)[:min(k, len(sims))]
-        return idx.tolist()
+        idx, _ = kb.topk_many([query_vec], k=k, exact=exact, rows=kb.scope_rows(course, tags))
+        return idx[0].tolist()
         
     except Exception as e:
         print(f"❌ Error in cosine_topk: {e}")
         return []
 
-def retrieve_context(cleaned_text: str, k: int = 8) -> str:
-    """Return top-k relevant context as a single string"""
-    if len(_CHUNKS) == 0:
-        return "No knowledge base available."
+def _format_context(kb: KnowledgeBase, idx: np.ndarray, scores: np.ndarray) -> str:
+    """Render ranked hits (row ids + scores from the ranking pass) as context"""
+    context_parts = []
+    for i, (row, score) in enumerate(zip(idx.tolist(), scores.tolist())):
+        if row < len(kb.chunks):
+            chunk = kb.chunks[row]
+            context_parts.append(f"### Relevant Content {i+1} (Score: {score:.3f})")
+            context_parts.append(f"**Course**: {chunk.get('course', 'Unknown')}")
+            context_parts.append(f"**Topics**: {', '.join(chunk.get('topic_tags', []))}")
+            context_parts.append(f"**Content**: {chunk.get('text', '')}")
+            context_parts.append("")
+    return "\n".join(context_parts)
+
+def mmr_select(
+    kb: KnowledgeBase,
+    rows: np.ndarray,
+    relevance: np.ndarray,
+    k: int,
+    mmr_lambda: float = MMR_LAMBDA,
+    max_per_parent: int = MMR_MAX_PER_PARENT,
+) -> np.ndarray:
+    """
+    Maximal-marginal-relevance re-ranking of candidate rows (best first).
+    Each step picks argmax(lambda * relevance - (1 - lambda) * max similarity
+    to the chunks already picked), skipping parents that already have
+    `max_per_parent` chunks. Relevance is min-max scaled so lambda means the
+    same for cosine, BM25 or fused scores. Returns positions into `rows`.
+    """
+    rows = np.asarray(rows, dtype=np.int64)
+    n = len(rows)
+    if n == 0 or k <= 0:
+        return np.empty(0, dtype=np.int64)
+    rel = np.asarray(relevance, dtype=np.float32)
+    lo, hi = float(rel.min()), float(rel.max())
+    rel = (rel - lo) / (hi - lo) if hi > lo else np.ones(n, dtype=np.float32)
     
-    if len(cleaned_text.strip()) < 10:
-        return "Query text too short for retrieval."
+    # Pairwise cosine between candidates (rows are unit-normalized)
+    if len(kb.E) == len(kb.parent_codes) and mmr_lambda < 1.0:
+        V = np.asarray(kb.E[rows], dtype=np.float32)
+        sim = V @ V.T
+    else:
+        sim = np.zeros((n, n), dtype=np.float32)
+    
+    codes = kb.parent_codes[rows]
+    per_parent = np.zeros(int(codes.max()) + 1, dtype=np.int64)
+    max_sim = np.zeros(n, dtype=np.float32)
+    available = np.ones(n, dtype=bool)
+    picked: List[int] = []
+    for _ in range(min(k, n)):
+        gain = mmr_lambda * rel - (1.0 - mmr_lambda) * max_sim
+        blocked = ~available
+        if max_per_parent > 0:
+            blocked |= per_parent[codes] >= max_per_parent
+        gain[blocked] = -np.inf
+        i = int(np.argmax(gain))
+        if gain[i] == -np.inf:
+            break
+        picked.append(i)
+        available[i] = False
+        per_parent[codes[i]] += 1
+        np.maximum(max_sim, sim[i], out=max_sim)
+    return np.array(picked, dtype=np.int64)
+
+def _diversify(
+    kb: KnowledgeBase, rows: np.ndarray, scores: np.ndarray, k: int, mmr_lambda: float, max_per_parent: int
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Top-k of a ranked candidate list after MMR (plain cut when MMR is off)"""
+    if mmr_lambda >= 1.0 and max_per_parent <= 0:
+        return rows[:k], scores[:k]
+    keep = mmr_select(kb, rows, scores, k, mmr_lambda, max_per_parent)
+    return rows[keep], scores[keep]
+
+def retrieve_many(
+    queries: List[str],
+    k: int = 8,
+    course: Optional[str] = None,
+    tags: Optional[List[str]] = None,
+    mmr_lambda: float = MMR_LAMBDA,
+    max_per_parent: int = MMR_MAX_PER_PARENT,
+) -> List[str]:
+    """
+    Return top-k context strings for many queries (e.g. one per transcript
+    segment or outline section) with one embedding call and one ranking pass.
+    Each query's k * MMR_DEPTH nearest chunks are MMR re-ranked down to k.
+    """
+    kb = get_kb()
+    if len(kb.chunks) == 0:
+        return ["No knowledge base available."] * len(queries)
+    
+    results = ["Query text too short for retrieval."] * len(queries)
+    todo = [i for i, q in enumerate(queries) if len(q.strip()) >= 10]
+    if not todo:
+        return results
     
     try:
-        print(f"🔍 Retrieving context for query: {cleaned_text[:100]}...")
-        
-        # Get query embedding using your Gemini client
-        embeddings = embed_texts([cleaned_text])
-        if not embeddings or len(embeddings) == 0:
-            return "Failed to generate query embedding."
+        print(f"🔍 Retrieving context for {len(todo)} queries...")
         
-        qv = embeddings[0]
-        print(f"✅ Generated query embedding of length: {len(qv)}")
+        # Get all query embeddings in one call
+        embeddings = kb.embed([queries[i] for i in todo])
+        if not embeddings or len(embeddings) != len(todo):
+            for i in todo:
+                results[i] = "Failed to generate query embedding."
+            return results
         
-        # Get top matches
-        top_idx = cosine_topk(qv, k=k)
+        print(f"✅ Generated {len(embeddings)} query embeddings of length: {len(embeddings[0])}")
         
-        if not top_idx:
-            return "No relevant context found in knowledge base."
+        # Rank all queries at once; scores are reused for formatting
+        top_idx, top_scores = kb.topk_many(embeddings, k=k * MMR_DEPTH, rows=kb.scope_rows(course, tags))
         
-        print(f"✅ Found {len(top_idx)} relevant chunks")
+        found = 0
+        for i, idx, scores in zip(todo, top_idx, top_scores):
+            idx, scores = _diversify(kb, idx, scores, k, mmr_lambda, max_per_parent)
+            found = max(found, len(idx))
+            if len(idx) == 0:
+                results[i] = "No relevant context found in knowledge base."
+            else:
+                results[i] = _format_context(kb, idx, scores)
         
-        # Combine top matches into a single context string
-        context_parts = []
-        for i, idx in enumerate(top_idx):
-            if idx < len(_CHUNKS):
-                chunk = _CHUNKS[idx]
-                score = 0.0
-                
-                # Calculate similarity score
-                try:
-                    chunk_vec = _E[idx]
-                    score = float(np.dot(chunk_vec, qv) / (np.linalg.norm(chunk_vec) * np.linalg.norm(qv)))
-                except:
-                    pass
-                
-                context_parts.append(f"### Relevant Content {i+1} (Score: {score:.3f})")
-                context_parts.append(f"**Course**: {chunk.get('course', 'Unknown')}")
-                context_parts.append(f"**Topics**: {', '.join(chunk.get('topic_tags', []))}")
-                context_parts.append(f"**Content**: {chunk.get('text', '')}")
-                context_parts.append("")
+        print(f"✅ Found {found} relevant chunks per query")
+        return results
         
-        return "\n".join(context_parts)
+    except Exception as e:
+        print(f"❌ Error in retrieve_many: {e}")
+        return [f"Knowledge base retrieval error: {str(e)}"] * len(queries)
+
+def _fuse(idx: np.ndarray, scores: np.ndarray, method: str = "rrf") -> Dict[int, float]:
+    """
+    Fuse per-window rankings into one score per KB row.
+    rrf: sum of 1 / (RRF_K + rank); max: best cosine over all windows.
+    """
+    fused: Dict[int, float] = {}
+    for row_idx, row_scores in zip(idx.tolist(), scores.tolist()):
+        for rank, (row, score) in enumerate(zip(row_idx, row_scores)):
+            if method == "max":
+                fused[row] = max(fused.get(row, -1.0), score)
+            else:
+                fused[row] = fused.get(row, 0.0) + 1.0 / (RRF_K + rank + 1)
+    return fused
+
+def _query_windows(
+    cleaned_text: str,
+    window_words: int = SEGMENT_WORDS,
+    overlap: int = SEGMENT_OVERLAP,
+    max_windows: int = MAX_SEGMENTS,
+) -> List[str]:
+    """Split a transcript into at most `max_windows` evenly spaced query windows"""
+    windows = [w for w in word_windows(cleaned_text, window_words, overlap) if len(w.strip()) >= 10]
+    if len(windows) > max_windows:
+        keep = np.linspace(0, len(windows) - 1, max_windows).round().astype(int)
+        windows = [windows[i] for i in keep]
+    return windows
+
+def _rank_windows(
+    kb: KnowledgeBase, windows: List[str], k: int, fusion: str = "rrf", rows: Optional[np.ndarray] = None
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Embed all windows in one batched call, rank them in one pass and fuse
+    the per-window rankings. Returns (rows, best cosine per row), best first.
+    """
+    embeddings = kb.embed(windows)
+    if not embeddings or len(embeddings) != len(windows):
+        raise RuntimeError("Failed to generate query embedding.")
+    top_idx, top_scores = kb.topk_many(embeddings, k=k, rows=rows)
+    if len(windows) == 1:
+        return top_idx[0], top_scores[0]
+    
+    fused = _fuse(top_idx, top_scores, fusion)
+    best_sim = _fuse(top_idx, top_scores, "max")
+    rows = sorted(fused, key=fused.get, reverse=True)[:k]
+    print(f"✅ Fused {len(fused)} candidates into {len(rows)} relevant chunks")
+    return np.array(rows, dtype=np.int64), np.array([best_sim[r] for r in rows], dtype=np.float32)
+
+def dense_search(
+    cleaned_text: str,
+    k: int = 8,
+    course: Optional[str] = None,
+    tags: Optional[List[str]] = None,
+    kb: Optional[KnowledgeBase] = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Dense top-k (rows, cosine scores) for any query length: short text is
+    embedded whole, long transcripts are windowed and fused. Raises on failure.
+    """
+    kb = kb or get_kb()
+    if len(kb.E) == 0:
+        raise RuntimeError("No embeddings available.")
+    if len(cleaned_text.split()) > SEGMENT_WORDS:
+        windows = _query_windows(cleaned_text)
+    else:
+        windows = [cleaned_text] if len(cleaned_text.strip()) >= 10 else []
+    if not windows:
+        raise ValueError("Query text too short for retrieval.")
+    return _rank_windows(kb, windows, k, rows=kb.scope_rows(course, tags))
+
+def retrieve_segmented(
+    cleaned_text: str,
+    k: int = 8,
+    window_words: int = SEGMENT_WORDS,
+    overlap: int = SEGMENT_OVERLAP,
+    max_windows: int = MAX_SEGMENTS,
+    fusion: str = "rrf",
+    course: Optional[str] = None,
+    tags: Optional[List[str]] = None,
+    mmr_lambda: float = MMR_LAMBDA,
+    max_per_parent: int = MMR_MAX_PER_PARENT,
+) -> str:
+    """
+    Retrieve for a long transcript window by window and fuse the per-window
+    rankings (RRF or max-sim) into one deduplicated top-k context string.
+    At most `max_windows` evenly spaced windows are embedded, so query size
+    and latency stay bounded however long the lecture is.
+    """
+    kb = get_kb()
+    if len(kb.chunks) == 0:
+        return "No knowledge base available."
+    
+    windows = _query_windows(cleaned_text, window_words, overlap, max_windows)
+    if not windows:
+        return "Query text too short for retrieval."
+    
+    try:
+        print(f"🔍 Retrieving context for {len(windows)} transcript windows...")
+        rows, scores = _rank_windows(kb, windows, k * MMR_DEPTH, fusion, rows=kb.scope_rows(course, tags))
+        rows, scores = _diversify(kb, rows, scores, k, mmr_lambda, max_per_parent)
+        if len(rows) == 0:
+            return "No relevant context found in knowledge base."
+        return _format_context(kb, rows, scores)
         
     except Exception as e:
-        print(f"❌ Error in retrieve_context: {e}")
+        print(f"❌ Error in retrieve_segmented: {e}")
         return f"Knowledge base retrieval error: {str(e)}"
 
-def simple_retrieve_context(cleaned_text: str, k: int = 8) -> str:
-    """Simple retriever that doesn't use embeddings"""
+def retrieve_context(
+    cleaned_text: str,
+    k: int = 8,
+    course: Optional[str] = None,
+    tags: Optional[List[str]] = None,
+) -> str:
+    """Return top-k relevant context as a single string"""
+    # Long transcripts are split into windows rather than embedded whole
+    if len(cleaned_text.split()) > SEGMENT_WORDS:
+        return retrieve_segmented(cleaned_text, k=k, course=course, tags=tags)
+    return retrieve_many([cleaned_text], k=k, course=course, tags=tags)[0]
+
+def simple_retrieve_context(
+    cleaned_text: str,
+    k: int = 8,
+    course: Optional[str] = None,
+    tags: Optional[List[str]] = None,
+) -> str:
+    """Simple retriever that doesn't use embeddings (BM25 over the whole KB)"""
     try:
-        if not CHUNKS.exists():
+        kb = get_kb()
+        if not kb.lex_chunks:
             return "Knowledge base not available."
         
-        chunks = []
-        with open(CHUNKS, "r", encoding="utf-8") as f:
-            for line in f:
-                chunks.append(json.loads(line.strip()))
-        
-        if not chunks:
+        if kb.bm25 is None:
             return "Knowledge base is empty."
         
-        # Simple keyword-based matching as fallback
-        query_words = set(cleaned_text.lower().split())
-        relevant_chunks = []
+        # BM25 ranking over the inverted index
+        rows = kb.scope_rows(course, tags)
+        idx, scores = kb.bm25.search(cleaned_text, k=k, rows=rows)
+        hits = list(zip(idx.tolist(), scores.tolist()))
         
-        for chunk in chunks[:k]:
-            chunk_text = chunk.get('text', '').lower()
-            chunk_course = chunk.get('course', '').lower()
-            
-            # Simple word matching
-            matches = len(query_words.intersection(set(chunk_text.split())))
-            if matches > 0:
-                relevant_chunks.append(chunk)
-        
-        if not relevant_chunks:
-            relevant_chunks = chunks[:k]  # Fallback to first k chunks
+        if not hits:
+            # Fallback to first k chunks (of the scope)
+            first = rows[:k].tolist() if rows is not None else range(min(k, len(kb.lex_chunks)))
+            hits = [(i, 0.0) for i in first]
         
         context_parts = []
-        for i, chunk in enumerate(relevant_chunks):
-            context_parts.append(f"### Content {i+1}")
+        for i, (row, score) in enumerate(hits):
+            chunk = kb.lex_chunks[row]
+            context_parts.append(f"### Content {i+1} (BM25: {score:.2f})")
             context_parts.append(f"**Course**: {chunk.get('course', 'Unknown')}")
             context_parts.append(f"**Content**: {chunk.get('text', '')}")
             context_parts.append("")
@@ -180,6 +549,156 @@ def simple_retrieve_context(cleaned_text: str, k: int = 8) -> str:
     except Exception as e:
         return f"Simple retrieval error: {str(e)}"
 
+# --------------------------
+# Hybrid (dense + BM25) retrieval
+# --------------------------
+class RetrievedChunk(BaseModel):
+    row: int
+    chunk_id: str
+    parent_id: str | None = None
+    course: str = "Unknown"
+    topic_tags: list[str] = []
+    text: str
+    score: float                        # fused score
+    dense_score: float | None = None    # cosine, if the dense path answered
+    lexical_score: float | None = None  # BM25, if the term matched
+
+def _fuse_scores(
+    dense: Tuple[np.ndarray, np.ndarray],
+    lexical: Tuple[np.ndarray, np.ndarray],
+    method: str = HYBRID_FUSION,
+    alpha: float = HYBRID_ALPHA,
+) -> Dict[int, float]:
+    """
+    Fuse the dense and lexical rankings.
+    rrf: sum of 1 / (RRF_K + rank); weighted: alpha * dense + (1 - alpha) * lexical
+    after min-max normalizing each list's scores.
+    """
+    fused: Dict[int, float] = {}
+    for weight, (rows, scores) in ((alpha, dense), (1.0 - alpha, lexical)):
+        if len(rows) == 0:
+            continue
+        if method == "weighted":
+            lo, hi = float(scores.min()), float(scores.max())
+            norm = (scores - lo) / (hi - lo) if hi > lo else np.ones_like(scores)
+            for row, v in zip(rows.tolist(), norm.tolist()):
+                fused[row] = fused.get(row, 0.0) + weight * v
+        else:
+            for rank, row in enumerate(rows.tolist()):
+                fused[row] = fused.get(row, 0.0) + 1.0 / (RRF_K + rank + 1)
+    return fused
+
+def hybrid_retrieve(
+    cleaned_text: str,
+    k: int = 8,
+    method: str = HYBRID_FUSION,
+    alpha: float = HYBRID_ALPHA,
+    budget_s: float = RETRIEVAL_BUDGET_S,
+    course: Optional[str] = None,
+    tags: Optional[List[str]] = None,
+    mmr_lambda: float = MMR_LAMBDA,
+    max_per_parent: int = MMR_MAX_PER_PARENT,
+    cache: Optional[bool] = None,
+) -> List[RetrievedChunk]:
+    """
+    Run dense and BM25 retrieval concurrently under one latency budget and
+    fuse them (RRF or weighted normalized scores).
+    Degraded mode: a path that fails or misses `budget_s` is dropped with a
+    warning and the other path answers alone (e.g. BM25-only ranking while
+    the embedding API is slow); such results are not cached. Each call has
+    its own workers, so an overrunning path (which cannot be interrupted
+    and still holds its Gemini request slot until it returns) never delays
+    later queries.
+    `course` / `tags` scope both paths to the matching rows. The fused
+    candidates are MMR re-ranked (mmr_lambda=1, max_per_parent=0 turns it off).
+    Complete results (both paths answered) are kept in the stage cache per
+    KB version, text and settings.
+    """
+    kb = get_kb()
+    if not kb.lex_chunks:
+        return []
+    key = stage_key(
+        "retrieve",
+        digest(kb.version, HYBRID_DEPTH, MMR_DEPTH),
+        digest(cleaned_text, k, method, alpha, course, sorted(tags or []), mmr_lambda, max_per_parent),
+    )
+    hit = load_stage(key, cache)
+    if hit is not None:
+        return [RetrievedChunk.model_validate(h) for h in hit["hits"]]
+    depth = k * HYBRID_DEPTH
+    empty = (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32))
+    
+    pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="retrieval")
+    try:
+        futures = {"dense": pool.submit(dense_search, cleaned_text, depth, course, tags, kb)}
+        if kb.bm25 is not None:
+            futures["lexical"] = pool.submit(kb.bm25.search, cleaned_text, depth, kb.scope_rows(course, tags))
+        done, _ = wait(futures.values(), timeout=budget_s)
+    finally:
+        # Work that has not started is cancelled; a running path finishes unobserved
+        pool.shutdown(wait=False, cancel_futures=True)
+    
+    results = {}
+    complete = True
+    for name, fut in futures.items():
+        if fut not in done:
+            print(f"⚠️ {name} retrieval missed the {budget_s:.1f}s budget")
+            results[name] = empty
+            complete = False
+        elif fut.exception() is not None:
+            print(f"⚠️ {name} retrieval failed: {fut.exception()}")
+            results[name] = empty
+            complete = False
+        else:
+            results[name] = fut.result()
+    dense = results.get("dense", empty)
+    lexical = results.get("lexical", empty)
+    
+    fused = _fuse_scores(dense, lexical, method, alpha)
+    dense_by_row = dict(zip(dense[0].tolist(), dense[1].tolist()))
+    lexical_by_row = dict(zip(lexical[0].tolist(), lexical[1].tolist()))
+    
+    ranked = np.array(sorted(fused, key=fused.get, reverse=True), dtype=np.int64)
+    rows, _ = _diversify(kb, ranked, np.array([fused[r] for r in ranked.tolist()], dtype=np.float32),
+                         k, mmr_lambda, max_per_parent)
+    
+    hits = []
+    for row in rows.tolist():
+        chunk = kb.lex_chunks[row]
+        hits.append(RetrievedChunk(
+            row=row,
+            chunk_id=chunk.get("id", str(row)),
+            parent_id=chunk.get("parent_id"),
+            course=chunk.get("course", "Unknown"),
+            topic_tags=chunk.get("topic_tags", []),
+            text=chunk.get("text", ""),
+            score=fused[row],
+            dense_score=dense_by_row.get(row),
+            lexical_score=lexical_by_row.get(row),
+        ))
+    print(f"✅ Hybrid retrieval: {len(dense[0])} dense + {len(lexical[0])} lexical -> "
+          f"{len(fused)} candidates -> {len(hits)} chunks")
+    if complete:
+        # A degraded answer (a path dropped) is not worth replaying
+        save_stage(key, {"hits": [h.model_dump() for h in hits]}, cache)
+    return hits
+
+def format_hits(hits: List[RetrievedChunk]) -> str:
+    """Render structured hits as the context block passed to the extractor"""
+    context_parts = []
+    for i, h in enumerate(hits):
+        scores = [f"fused {h.score:.3f}"]
+        if h.dense_score is not None:
+            scores.append(f"dense {h.dense_score:.3f}")
+        if h.lexical_score is not None:
+            scores.append(f"bm25 {h.lexical_score:.2f}")
+        context_parts.append(f"### Relevant Content {i+1} ({', '.join(scores)})")
+        context_parts.append(f"**Course**: {h.course}")
+        context_parts.append(f"**Topics**: {', '.join(h.topic_tags)}")
+        context_parts.append(f"**Content**: {h.text}")
+        context_parts.append("")
+    return "\n".join(context_parts)
+
 # Test function
 def test_retrieval():
     """Test the retrieval system"""
@@ -0,0 +1,66 @@
+from __future__ import annotations
+import hashlib
+import json
+import os
+from typing import Any, Dict, Optional
+
+from utils.disk_cache import DiskCache
+from utils.fs import CACHE_DIR
+
+# --------------------------
+# Pipeline stage cache
+# --------------------------
+# Each stage (clean -> retrieve -> outline) stores its output under
+#   <stage>:<stage version>:<input digest>
+# where the stage version hashes everything that shapes the output besides
+# the input (prompt, model, chunking settings, ...). Re-running a stage on
+# the same input with the same version replays the stored output; editing a
+# prompt or switching model changes the version, so old entries are simply
+# never looked up again and age out of the LRU.
+STAGE_CACHE_ENABLED = os.getenv("STAGE_CACHE", "1") != "0"
+STAGE_CACHE_MB = int(os.getenv("STAGE_CACHE_MB", "256"))
+
+_stage_cache: Optional[DiskCache] = None
+
+
+def _get_stage_cache() -> DiskCache:
+    """Open the on-disk stage cache on first use"""
+    global _stage_cache
+    if _stage_cache is None:
+        _stage_cache = DiskCache(CACHE_DIR / "stages.sqlite", max_bytes=STAGE_CACHE_MB * 2**20)
+    return _stage_cache
+
+
+def digest(*parts: Any) -> str:
+    """sha256 over strings / JSON-serializable values"""
+    h = hashlib.sha256()
+    for part in parts:
+        data = part if isinstance(part, str) else json.dumps(part, sort_keys=True, default=str)
+        h.update(data.encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+def stage_key(stage: str, version: str, input_digest: str) -> str:
+    return f"{stage}:{version[:16]}:{input_digest}"
+
+
+def load_stage(key: str, enabled: Optional[bool] = None) -> Optional[Dict[str, Any]]:
+    """Stored output of a stage run, or None (also when caching is off)"""
+    if not (STAGE_CACHE_ENABLED if enabled is None else enabled):
+        return None
+    raw = _get_stage_cache().get(key)
+    if raw is None:
+        return None
+    print(f"🧠 Stage cache hit: {key.split(':', 1)[0]}")
+    return json.loads(raw)
+
+
+def save_stage(key: str, value: Dict[str, Any], enabled: Optional[bool] = None) -> None:
+    if STAGE_CACHE_ENABLED if enabled is None else enabled:
+        _get_stage_cache().put(key, json.dumps(value).encode("utf-8"))
+
+
+def stage_cache_stats() -> Dict[str, float]:
+    """Hit/miss counters and size of the stage cache."""
+    return _get_stage_cache().stats()
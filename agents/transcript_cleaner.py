@@ -1,12 +1,34 @@
 from __future__ import annotations
+import itertools
+import os
+import queue
+import re
+import tempfile
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from difflib import SequenceMatcher
 from pathlib import Path
-from typing import Tuple, Optional
-from pydub import AudioSegment
-from pypdf import PdfReader
-from .gemini_client import gen_text, upload_file
-from .gemini_client import types  # re-exported
+from typing import Callable, Iterable, Iterator, List, Tuple, Optional, Union
+from .gemini_client import MODEL, file_digest, gen_text, gen_text_stream, upload_file
+from .audio_pipeline import SEGMENT_MAX_S, SEGMENT_PROMPT, transcribe_audio
+from .media_prep import (
+    SPEECH_BITRATE, SPEECH_FORMAT, SPEECH_SAMPLE_RATE,
+    AudioDecodeError, export_speech, load_speech, report_savings,
+)
+from .pdf_reader import iter_pdf_pages
+from .stage_cache import digest, load_stage, save_stage, stage_key
+from utils.dedupe import DEDUPE_SAMPLE_PAGES, EDGE_LINES, NEAR_DUP_CONTAINMENT, REPEAT_PAGE_FRAC, dedupe_page_stream
 from utils.fs import DATA_PROC, ts
-from utils.text import strip_fillers, squeeze_spaces
+from utils.text_quality import CLEAN_BYPASS_SCORE, score_text
+from utils.text import norm_key, split_sentences, strip_fillers, squeeze_spaces
+from utils.tokens import count_tokens, truncate_tokens
+
+# Chunked (map-reduce) cleaning of long text inputs
+CLEAN_WINDOW_TOKENS = int(os.getenv("CLEAN_WINDOW_TOKENS", "6000"))   # input tokens per window
+CLEAN_OVERLAP_TOKENS = int(os.getenv("CLEAN_OVERLAP_TOKENS", "200"))  # read-only context from the previous window
+CLEAN_WORKERS = int(os.getenv("CLEAN_WORKERS", "4"))
+DUP_RATIO = 0.85  # share of the words before a window's new text that must be context to drop them
+PDF_DEDUPE = os.getenv("PDF_DEDUPE", "1") != "0"  # strip repeated headers / duplicate slides
 
 
 
@@ -19,41 +41,294 @@ Goals:
 Output ONLY the cleaned transcript text.
 """
 
-def _read_pdf(path: Path) -> str:
-    reader = PdfReader(str(path))
-    pages = [p.extract_text() or "" for p in reader.pages]
-    return "\n\n".join(pages)
+CONTEXT_PROMPT = (
+    "The text in <context> is the end of the previous part of the same transcript. "
+    "Use it only to continue sentences and speaker labels; do NOT output it.\n"
+    "Clean ONLY the text in <text>."
+)
+
+AUDIO_PROMPT = (
+    "Transcribe this audio/video. Use readable punctuation, minimal fillers.\n"
+    "Insert a [mm:ss] timestamp about every 60 seconds.\n"
+    "If speakers are discernible, label them Speaker 1, Speaker 2, ...\n"
+    "Return ONLY the cleaned transcript text."
+)
+
+# Everything besides the input file that shapes the cleaned text (stage cache key)
+CLEAN_STAGE_VERSION = digest(
+    SYS_PROMPT, CONTEXT_PROMPT, AUDIO_PROMPT, SEGMENT_PROMPT, MODEL,
+    CLEAN_WINDOW_TOKENS, CLEAN_OVERLAP_TOKENS, SEGMENT_MAX_S,
+    PDF_DEDUPE, REPEAT_PAGE_FRAC, EDGE_LINES, DEDUPE_SAMPLE_PAGES, NEAR_DUP_CONTAINMENT, CLEAN_BYPASS_SCORE,
+    SPEECH_SAMPLE_RATE, SPEECH_FORMAT, SPEECH_BITRATE,
+)
 
-def _load_text_like(path: Path) -> str:
+def _iter_text_like(path: Path) -> Iterator[str]:
+    """
+    Text blocks of an input: the whole file, or one block per PDF page
+    (repeated header/footer lines and near-duplicate slides removed).
+    """
     if path.suffix.lower() in {".txt", ".md"}:
-        return Path(path).read_text(encoding="utf-8", errors="ignore")
-    if path.suffix.lower() in {".pdf"}:
-        return _read_pdf(path)
-    raise ValueError("Unsupported text file: " + str(path))
+        yield Path(path).read_text(encoding="utf-8", errors="ignore")
+    elif path.suffix.lower() in {".pdf"}:
+        pages = iter_pdf_pages(path)
+        # Pages still stream: headers / footers are learned from the first few
+        yield from (dedupe_page_stream(pages) if PDF_DEDUPE else pages)
+    else:
+        raise ValueError("Unsupported text file: " + str(path))
+
+def _generate(prompt: str, on_text: Optional[Callable[[str], None]], **kwargs) -> str:
+    """gen_text, or gen_text_stream feeding on_text as fragments arrive"""
+    if on_text is None:
+        return gen_text(prompt, **kwargs).text.strip()
+    parts = []
+    for fragment in gen_text_stream(prompt, **kwargs):
+        parts.append(fragment)
+        on_text(fragment)
+    return "".join(parts).strip()
+
+def _tidy(blocks: Iterable[str]) -> str:
+    """Whitespace-only normalization for text that skips the LLM pass (line structure kept)"""
+    text = "\n\n".join(blocks)
+    text = "\n".join(re.sub(r"[ \t]+", " ", line).strip() for line in text.splitlines())
+    return re.sub(r"\n{3,}", "\n\n", text).strip()
+
+# --------------------------
+# Chunked cleaning
+# --------------------------
+def _iter_units(blocks: Iterable[str], max_tokens: int) -> Iterator[Tuple[str, str, int]]:
+    """
+    Split text blocks (e.g. PDF pages) into (separator, piece, tokens) units
+    on paragraph, then sentence boundaries; a single over-long sentence is
+    cut by tokens.
+    """
+    for block in blocks:
+        for para in re.split(r"\n\s*\n", block):
+            para = squeeze_spaces(strip_fillers(para))
+            if not para:
+                continue
+            sep = "\n\n"
+            cost = count_tokens(para)
+            pieces = [para] if cost <= max_tokens else split_sentences(para)
+            for piece in pieces:
+                while count_tokens(piece) > max_tokens:
+                    head = truncate_tokens(piece, max_tokens)
+                    if not head or not piece.startswith(head):
+                        # Always make progress (e.g. a decoded cut that is not a clean prefix)
+                        head = piece[: max(1, max_tokens)]
+                    yield sep, head, count_tokens(head)
+                    piece, sep = piece[len(head):].strip(), " "
+                if piece:
+                    yield sep, piece, (cost if piece is para else count_tokens(piece))
+                sep = " "
+
+def _iter_windows(
+    units: Iterable[Tuple[str, str, int]], max_tokens: int, overlap_tokens: int
+) -> Iterator[Tuple[str, str]]:
+    """
+    Greedy token-bounded windows over a stream of units, as (context, text)
+    pairs; a window is yielded as soon as it is full. `text` is the new text
+    of the window; `context` is the end of its predecessor (up to
+    overlap_tokens, empty for the first window), sent along read-only.
+    """
+    join = lambda us: "".join(sep + u for sep, u, _ in us).strip()
+    buf: List[Tuple[str, str, int]] = []
+    used = carried = 0  # carried: leading units of buf repeated from the previous window
+    for unit in units:
+        if len(buf) > carried and used + unit[2] > max_tokens:
+            yield join(buf[:carried]), join(buf[carried:])
+            # Carry trailing units (up to overlap_tokens) into the next window
+            tail, tail_cost = [], 0
+            for u in reversed(buf[carried + 1:]):
+                if tail_cost + u[2] > overlap_tokens:
+                    break
+                tail.insert(0, u)
+                tail_cost += u[2]
+            buf, used, carried = tail, tail_cost, len(tail)
+        buf.append(unit)
+        used += unit[2]
+    if len(buf) > carried:
+        yield join(buf[:carried]), join(buf[carried:])
+
+def _window_prompt(context: str, text: str) -> str:
+    """Cleaning prompt for one window: the new text, plus the previous window's end as context"""
+    if not context:
+        return text
+    return f"{CONTEXT_PROMPT}\n\n<context>\n{context}\n</context>\n\n<text>\n{text}\n</text>"
 
-def transcribe_and_clean(input_path: str) -> Tuple[str, Path]:
+def _word_keys(text: str) -> List[Tuple[str, int]]:
+    """(normalized word, end offset) for each word of text that has letters or digits"""
+    keys = ((norm_key(w.group()).replace(" ", ""), w.end()) for w in re.finditer(r"\S+", text))
+    return [(k, end) for k, end in keys if k]
+
+def _drop_overlap(context: str, text: str, cleaned: str) -> str:
+    """
+    Safety net for a model that repeats the read-only context anyway: drop
+    a leading echo of it from a cleaned window. The output is aligned word
+    by word (normalized, since raw transcripts have no punctuation to split
+    sentences on) against context + text, and cut where the new text starts
+    if what comes before it is mostly context.
+    """
+    expected = [k for k, _ in _word_keys(context)]
+    if not expected:
+        return cleaned
+    fresh = [k for k, _ in _word_keys(text)][: len(expected)]
+    words = _word_keys(cleaned)[: 2 * len(expected) + len(fresh)]
+    blocks = SequenceMatcher(None, expected + fresh, [k for k, _ in words], autojunk=False).get_matching_blocks()
+    n = len(expected)
+    start = next((b.b + n - b.a for b in blocks if b.size and b.a + b.size > n), None)
+    if start is None or start <= 0:
+        return cleaned
+    start = min(start, len(words))
+    echoed = sum(max(0, min(b.a + b.size, n) - b.a) for b in blocks if b.b < start)
+    if echoed < max(1, DUP_RATIO * start):
+        return cleaned
+    return cleaned[words[start - 1][1]:].lstrip(" \t\n.,;:!?")
+
+def clean_chunked(
+    blocks: Union[str, Iterable[str]],
+    on_text: Optional[Callable[[str], None]] = None,
+    window_tokens: int = CLEAN_WINDOW_TOKENS,
+    overlap_tokens: int = CLEAN_OVERLAP_TOKENS,
+    workers: int = CLEAN_WORKERS,
+) -> str:
+    """
+    Map-reduce cleaning: token-bounded windows are cleaned concurrently
+    (at most `workers` calls in flight) and stitched back in order. Each
+    window gets the end of the previous one as read-only context, so
+    sentences cut at a window edge still read on, and the cleaned windows
+    do not overlap. `blocks` may be a lazy stream (e.g. PDF pages): each
+    window is submitted as soon as it fills, while later pages are still
+    being parsed. The first window is streamed to on_text on the
+    caller's thread, so output shows up in seconds; later windows reach
+    on_text whole, in order.
+    """
+    if isinstance(blocks, str):
+        blocks = [blocks]
+    windows = _iter_windows(_iter_units(blocks, window_tokens), window_tokens, overlap_tokens)
+    first = next(windows, None)
+    if first is None:
+        return ""
+
+    def clean(context: str, text: str) -> str:
+        return gen_text(_window_prompt(context, text), system_instruction=SYS_PROMPT, temperature=0.1).text.strip()
+
+    submitted: "queue.Queue[Union[Tuple[str, str, Future], BaseException, None]]" = queue.Queue()
+    stop = threading.Event()
+    count = [1]
+
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="clean") as pool:
+        def produce() -> None:
+            # Keep building and submitting windows while the first one streams
+            try:
+                for context, text in windows:
+                    if stop.is_set():
+                        break
+                    submitted.put((context, text, pool.submit(clean, context, text)))
+                    count[0] += 1
+            except BaseException as e:
+                submitted.put(e)
+                return
+            submitted.put(None)
+
+        producer = threading.Thread(target=produce, name="clean-windows", daemon=True)
+        producer.start()
+        try:
+            stitched = [_generate(first[1], on_text, system_instruction=SYS_PROMPT, temperature=0.1)]
+            while (item := submitted.get()) is not None:
+                if isinstance(item, BaseException):
+                    raise item
+                context, text, fut = item
+                part = _drop_overlap(context, text, fut.result())
+                if part:
+                    stitched.append(part)
+                    if on_text is not None:
+                        on_text("\n\n" + part)
+        finally:
+            stop.set()
+            producer.join()
+            while not submitted.empty():
+                item = submitted.get_nowait()
+                if isinstance(item, tuple):
+                    item[-1].cancel()
+    print(f"🧹 Cleaned {count[0]} windows with up to {min(workers, count[0] - 1) + 1} concurrent calls")
+    return "\n\n".join(p for p in stitched if p)
+
+def transcribe_and_clean(
+    input_path: str,
+    on_upload_progress: Optional[Callable[[int, int], None]] = None,
+    on_text: Optional[Callable[[str], None]] = None,
+    cache: Optional[bool] = None,
+) -> Tuple[str, Path]:
+    """
+    Clean a text/PDF transcript, or transcribe + clean audio/video.
+    on_upload_progress(sent, total) is called while a recording uploads;
+    a recording uploaded earlier (same content) is reused, not re-sent.
+    on_text(fragment) streams the cleaned text as it is generated.
+    Text that already reads as clean (utils.text_quality) skips the LLM pass.
+    The result is kept in the stage cache under the file's content hash, so
+    the same material is only transcribed once (cache=False forces a re-run).
+    """
     path = Path(input_path)
     if not path.exists():
         raise FileNotFoundError(path)
 
+    key = stage_key("clean", CLEAN_STAGE_VERSION, file_digest(str(path)))
+    hit = load_stage(key, cache)
+    if hit is not None:
+        cleaned, out_path = hit["text"], Path(hit["path"])
+        if not out_path.exists():
+            out_path = DATA_PROC / f"cleaned_{ts()}.txt"
+            out_path.write_text(cleaned, encoding="utf-8")
+        if on_text is not None:
+            on_text(cleaned)
+        return cleaned, out_path
+
     if path.suffix.lower() in {".txt", ".md", ".pdf"}:
-        raw = _load_text_like(path)
-        # light local cleanup before LLM pass
-        rough = squeeze_spaces(strip_fillers(raw))
-        resp = gen_text(rough, system_instruction=SYS_PROMPT, temperature=0.1)
-        cleaned = resp.text.strip()
+        # Read blocks (PDF pages) only until the input is known to be long
+        blocks = _iter_text_like(path)
+        head, tokens = [], 0
+        for block in blocks:
+            head.append(block)
+            tokens += count_tokens(block)
+            if tokens > CLEAN_WINDOW_TOKENS:
+                break
+        # Written notes / prose need no cleaning: judged locally on the text read so far
+        quality = score_text("\n\n".join(head))
+        print(f"🔍 Input {quality.describe()}: "
+              + ("already clean, skipping the LLM cleaning pass" if quality.is_clean else "cleaning with the LLM"))
+        if quality.is_clean:
+            cleaned = _tidy(itertools.chain(head, blocks))
+            if on_text is not None:
+                on_text(cleaned)
+        elif tokens > CLEAN_WINDOW_TOKENS:
+            # Long inputs: clean windows in parallel while the rest is still parsed
+            cleaned = clean_chunked(itertools.chain(head, blocks), on_text)
+        else:
+            # light local cleanup before LLM pass
+            rough = squeeze_spaces(strip_fillers("\n\n".join(head)))
+            cleaned = _generate(rough, on_text, system_instruction=SYS_PROMPT, temperature=0.1)
     else:
-        # audio branch – upload and ask Gemini to transcribe + clean
-        file_part = upload_file(str(path))
-        prompt = (
-            "Transcribe this audio/video. Use readable punctuation, minimal fillers.\n"
-            "Insert a [mm:ss] timestamp about every 60 seconds.\n"
-            "If speakers are discernible, label them Speaker 1, Speaker 2, ...\n"
-            "Return ONLY the cleaned transcript text."
-        )
-        resp = gen_text(prompt, system_instruction=SYS_PROMPT, attachments=[file_part])
-        cleaned = resp.text.strip()
+        # audio branch – decoded once as mono speech-rate audio (no video track)
+        audio = None
+        try:
+            audio = load_speech(str(path))
+        except AudioDecodeError as e:
+            print(f"⚠️ Could not decode {e}; sending the recording as is")
+        # long recordings: split on silence, transcribe segments in parallel
+        cleaned = transcribe_audio(audio, str(path), system_instruction=SYS_PROMPT, on_text=on_text) if audio is not None else None
+        if cleaned is None:
+            # upload whole (compressed when decodable) and ask Gemini to transcribe + clean
+            with tempfile.TemporaryDirectory(prefix="media-") as tmp:
+                upload_path = path
+                if audio is not None:
+                    prepared = export_speech(audio, Path(tmp) / path.stem)
+                    if report_savings(path, [prepared]) > 0:
+                        upload_path = prepared
+                del audio
+                file_part = upload_file(str(upload_path), on_progress=on_upload_progress)
+            cleaned = _generate(AUDIO_PROMPT, on_text, system_instruction=SYS_PROMPT, attachments=[file_part])
 
     out_path = DATA_PROC / f"cleaned_{ts()}.txt"
     out_path.write_text(cleaned, encoding="utf-8")
+    save_stage(key, {"text": cleaned, "path": str(out_path)}, cache)
     return cleaned, out_path
@@ -3,16 +3,15 @@ import streamlit as st
 from pathlib import Path
 import time
 
-# Agents
-from agents.transcript_cleaner import transcribe_and_clean
-from agents.keypoints_extractor import extract_outline
-from agents.slide_generator import outline_to_pptx
-from agents.retriever import retrieve_context  # ✅ KB retrieval
+# Agents are imported inside the pipeline (python-pptx, pypdf, numpy and the
+# Gemini SDK are not needed to render the login screen)
 
 # Utils
 from utils.fs import DATA_IN
 from utils import auth
 
+LIVE_TAIL_CHARS = 3000  # characters of the live transcript shown while it streams
+
 # Lottie
 try:
     from streamlit_lottie import st_lottie
@@ -37,6 +36,17 @@ if "username" not in st.session_state:
 if "run_pipeline" not in st.session_state:
     st.session_state.run_pipeline = False
 
+# --------------------------
+# KNOWLEDGE BASE (loaded on first use)
+# --------------------------
+# retriever.get_kb() caches the KB per process and reloads it when
+# kb_builder publishes a new version, so it is not cached again here.
+def kb_courses() -> list[str]:
+    """Courses of the live KB version"""
+    from agents.retriever import list_courses
+    with st.spinner("📚 Loading knowledge base..."):
+        return list_courses()
+
 # --------------------------
 # LOTTIE ANIMATIONS
 # --------------------------
@@ -503,6 +513,13 @@ with st.sidebar:
         value=True,
         help="Leverage existing course materials to enhance slide quality"
     )
+    kb_course = "All courses"
+    if use_kb:
+        kb_course = st.selectbox(
+            "Course scope",
+            ["All courses"] + kb_courses(),
+            help="Retrieve only from this course's part of the knowledge base"
+        )
     
     st.markdown("---")
     
@@ -510,6 +527,7 @@ with st.sidebar:
     if st.button("🚀 Process Lecture Notes", type="primary", use_container_width=True):
         st.session_state.run_pipeline = True
         st.session_state.use_kb = use_kb
+        st.session_state.kb_course = None if kb_course == "All courses" else kb_course
 
     st.markdown("---")
 
@@ -542,6 +560,11 @@ if st.session_state.get('run_pipeline', False):
     path = uploaded_path or (DATA_IN / choice if choice and choice != "—" else None)
 
     if path and path.exists():
+        from agents.transcript_cleaner import transcribe_and_clean
+        from agents.keypoints_extractor import extract_outline
+        from agents.slide_generator import outline_to_pptx
+        from agents.retriever import hybrid_retrieve, format_hits  # ✅ KB retrieval
+        
         # Initialize progress
         progress_bar = st.progress(0)
         status_text = st.empty()
@@ -550,9 +573,28 @@ if st.session_state.get('run_pipeline', False):
             # Step 1: Transcription & Cleaning
             with st.spinner("🎤 Transcribing lecture content..."):
                 status_text.text("Step 1/4: Transcribing audio/text content...")
-                cleaned, cleaned_path = transcribe_and_clean(str(path))
+                
+                def show_upload(sent, total):
+                    status_text.text(f"Step 1/4: Uploading recording... {sent * 100 // max(total, 1)}%")
+                
+                # Cleaned text is rendered as it streams in: only the latest part,
+                # at most a few times a second, so each update stays small
+                live_text = st.empty()
+                live = {"tail": "", "drawn": 0.0}
+                
+                def show_text(fragment):
+                    live["tail"] = (live["tail"] + fragment)[-LIVE_TAIL_CHARS:]
+                    now = time.monotonic()
+                    if now - live["drawn"] < 0.3:
+                        return
+                    live["drawn"] = now
+                    live_text.markdown(f"**Live transcript**\n\n…{live['tail']}")
+                
+                cleaned, cleaned_path = transcribe_and_clean(
+                    str(path), on_upload_progress=show_upload, on_text=show_text
+                )
+                live_text.empty()
                 progress_bar.progress(25)
-                time.sleep(0.5)
             
             # # Step 2: Knowledge Base Retrieval (if enabled)
             # kb_context = ""
@@ -572,43 +614,35 @@ if st.session_state.get('run_pipeline', False):
 
             # Step 2: Knowledge Base Retrieval (if enabled)
             kb_context = ""
+            kb_hits = []
             if st.session_state.get('use_kb', True):
                 with st.spinner("🧠 Retrieving relevant knowledge..."):
                     status_text.text("Step 2/4: Enhancing with knowledge base...")
                     try:
-                        # Try main retriever first
-                        kb_context = retrieve_context(cleaned)
-                        if "error" in kb_context.lower() or "not available" in kb_context.lower():
-                            st.warning("Using simple retrieval mode")
-                            from agents.retriever import simple_retrieve_context
-                            kb_context = simple_retrieve_context(cleaned)
+                        # Dense + BM25 run together under one latency budget
+                        kb_hits = hybrid_retrieve(cleaned, course=st.session_state.get('kb_course'))
+                        if kb_hits and all(h.dense_score is None for h in kb_hits):
+                            st.warning("Using keyword retrieval only (embeddings unavailable)")
+                        kb_context = format_hits(kb_hits)
                     except Exception as kb_error:
                         st.warning(f"⚠️ Knowledge base retrieval failed: {str(kb_error)}")
-                        # Use simple fallback
-                        from agents.retriever import simple_retrieve_context
-                        kb_context = simple_retrieve_context(cleaned)    
-
-                
+                        kb_context = ""
+                        kb_hits = []
+            progress_bar.progress(50)
             
             # Step 3: Key Points Extraction (with KB context if available)
             with st.spinner("🔍 Extracting key concepts..."):
                 status_text.text("Step 3/4: Analyzing content structure...")
                 
-                # Combine cleaned text with KB context for better extraction
-                enhanced_content = cleaned
-                if kb_context:
-                    enhanced_content = f"{cleaned}\n\nRelevant Context:\n{kb_context}"
-                
-                outline, outline_path = extract_outline(enhanced_content)
+                # KB hits are packed next to the transcript within the prompt token budget
+                outline, outline_path = extract_outline(cleaned, kb_hits)
                 progress_bar.progress(75)
-                time.sleep(0.5)
             
             # Step 4: Slide Generation
             with st.spinner("📊 Creating presentation slides..."):
                 status_text.text("Step 4/4: Generating professional slides...")
                 pptx_path = outline_to_pptx(outline, filename_stem=Path(path).stem)
                 progress_bar.progress(100)
-                time.sleep(0.5)
             
             # Success Message
             status_text.success("✅ Lecture processed successfully! Download your presentation below.")
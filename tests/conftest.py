@@ -0,0 +1,66 @@
+from __future__ import annotations
+import json
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+
+# --------------------------
+# Local stand-in for the Gemini API
+# --------------------------
+class _FakeGemini(BaseHTTPRequestHandler):
+    """Answers generateContent, batchEmbedContents and resumable uploads; keep-alive like the real API."""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args) -> None:
+        pass
+
+    def do_POST(self) -> None:
+        raw = self.rfile.read(int(self.headers.get("content-length", 0)))
+        command = self.headers.get("x-goog-upload-command", "")
+        headers = {}
+        if command == "start":  # resumable upload: hand out the session URL
+            headers["x-goog-upload-url"] = f"http://{self.headers['host']}/upload-session"
+            out = {}
+        elif command:
+            headers["x-goog-upload-status"] = "final" if "finalize" in command else "active"
+            out = {"file": {"name": "files/clip", "uri": "https://example.invalid/files/clip",
+                            "mimeType": "audio/wav", "state": "ACTIVE"}}
+        elif self.path.endswith(":batchEmbedContents"):
+            body = json.loads(raw)
+            out = {"embeddings": [{"values": [float(len(json.dumps(r))), 1.0, 0.5]} for r in body["requests"]]}
+        else:
+            out = {"candidates": [{"content": {"role": "model", "parts": [{"text": "ok"}]}}]}
+        data = json.dumps(out).encode("utf-8")
+        self.send_response(200)
+        self.send_header("content-type", "application/json")
+        self.send_header("content-length", str(len(data)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+
+@pytest.fixture
+def fake_gemini(monkeypatch, tmp_path):
+    """Point a fresh shared Gemini client at a local server (no caches, no API key needed)."""
+    from agents import gemini_client
+    from utils.disk_cache import DiskCache
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _FakeGemini)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setenv("GOOGLE_GEMINI_BASE_URL", f"http://127.0.0.1:{server.server_address[1]}")
+    monkeypatch.setenv("GEMINI_API_KEY", "test")
+    monkeypatch.setattr(gemini_client, "_client", None)
+    monkeypatch.setattr(gemini_client, "EMBED_CACHE_ENABLED", False)
+    monkeypatch.setattr(gemini_client, "GEN_CACHE_ENABLED", False)
+    monkeypatch.setattr(gemini_client, "_upload_registry", DiskCache(tmp_path / "uploads.sqlite", max_bytes=2**20))
+    yield gemini_client
+    server.shutdown()
+    server.server_close()
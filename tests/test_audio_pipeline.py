@@ -0,0 +1,26 @@
+from __future__ import annotations
+import threading
+
+from pydub import AudioSegment
+from pydub.generators import Sine
+
+from agents import audio_pipeline
+
+
+def _lecture(seconds: int) -> AudioSegment:
+    # 20 s of tone, then a 2 s pause, repeated
+    block = Sine(220, sample_rate=8000).to_audio_segment(duration=20_000, volume=-12) + AudioSegment.silent(2_000, 8000)
+    audio = block * (seconds // 22 + 1)
+    return audio[: seconds * 1000].set_channels(1)
+
+
+def test_two_recordings_in_one_process(fake_gemini, tmp_path):
+    for name in ("first.wav", "second.wav"):
+        audio = _lecture(150)
+        audio.export(tmp_path / name, format="wav")
+        calls = []
+        text = audio_pipeline.transcribe_audio(
+            audio, str(tmp_path / name), on_text=lambda t: calls.append(threading.current_thread()), max_segment_s=60
+        )
+        assert text.split("\n\n") == ["ok"] * 3
+        assert calls == [threading.main_thread()] * 3
@@ -0,0 +1,22 @@
+from __future__ import annotations
+import asyncio
+
+
+def test_run_sync_twice_reuses_the_async_client(fake_gemini):
+    g = fake_gemini
+    texts = [f"text {i}" for i in range(3 * g.EMBED_BATCH_SIZE)]
+    for _ in range(2):
+        assert len(g.embed_texts(texts, backend="gemini", parallel=True)) == len(texts)
+        assert g.run_sync(g.agen_text("hello")).text == "ok"
+
+
+def test_async_calls_from_other_loops(fake_gemini):
+    g = fake_gemini
+
+    async def main():
+        awaited = await g.agen_text("direct")
+        nested = g.run_sync(g.agen_text("nested"))
+        return awaited.text, nested.text
+
+    assert asyncio.run(main()) == ("ok", "ok")
+    assert asyncio.run(main()) == ("ok", "ok")
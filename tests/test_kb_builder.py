@@ -0,0 +1,31 @@
+from __future__ import annotations
+import json
+
+import numpy as np
+
+from agents import kb_builder
+from agents.kb_store import VEC_NAME, current_kb_dir, open_vectors, read_meta
+
+
+def _write_seed(path, n):
+    with open(path, "w", encoding="utf-8") as f:
+        for i in range(n):
+            rec = {"id": f"L{i}", "course": "IT", "topic_tags": [], "transcript": f"lecture {i} covers topic {i * 7}"}
+            f.write(json.dumps(rec) + "\n")
+
+
+def test_gemini_build_spans_several_flushes(fake_gemini, tmp_path):
+    n = 2 * kb_builder.EMBED_FLUSH + 88
+    seed = tmp_path / "seed.jsonl"
+    _write_seed(seed, n)
+
+    kb_builder.build_kb(seed, tmp_path / "kb", backend="gemini")
+    kb_dir = current_kb_dir(tmp_path / "kb")
+    assert read_meta(kb_dir)["rows"] == n
+    V = open_vectors(kb_dir / VEC_NAME)
+    assert V.shape[0] == n and np.isfinite(np.asarray(V, dtype=np.float32)).all()
+
+    # A second build in the same process embeds only the new lectures
+    _write_seed(seed, n + kb_builder.EMBED_FLUSH)
+    kb_builder.build_kb(seed, tmp_path / "kb", backend="gemini")
+    assert read_meta(current_kb_dir(tmp_path / "kb"))["rows"] == n + kb_builder.EMBED_FLUSH
@@ -0,0 +1,39 @@
+from __future__ import annotations
+import re
+from types import SimpleNamespace
+
+import pytest
+
+from agents import transcript_cleaner
+from utils.text import split_sentences
+
+
+def _paragraphs(n):
+    # Raw speech: no punctuation, no casing, a filler now and then
+    return [f"um so paragraph {i} talks about topic {i * 3} and then we move on to the next idea" for i in range(n)]
+
+
+def _fake_cleaner(echo_context: bool):
+    """Adds punctuation and casing per paragraph; optionally repeats the context it was told not to output."""
+
+    def clean(raw: str) -> str:
+        return "\n\n".join(p.strip().capitalize() + "." for p in re.split(r"\n\s*\n", raw) if p.strip())
+
+    def gen_text(prompt, **kwargs):
+        m = re.search(r"<context>\n(.*)\n</context>\n\n<text>\n(.*)\n</text>", prompt, re.S)
+        if m is None:
+            return SimpleNamespace(text=clean(prompt))
+        context, text = m.groups()
+        return SimpleNamespace(text=(clean(context) + "\n\n" if echo_context else "") + clean(text))
+
+    return gen_text
+
+
+@pytest.mark.parametrize("echo_context", [False, True])
+def test_unpunctuated_windows_are_stitched_without_repeats(monkeypatch, echo_context):
+    monkeypatch.setattr(transcript_cleaner, "gen_text", _fake_cleaner(echo_context))
+    paragraphs = _paragraphs(2000)
+    out = transcript_cleaner.clean_chunked(["\n\n".join(paragraphs)], window_tokens=600, overlap_tokens=60, workers=2)
+    sentences = split_sentences(out.replace("\n\n", " "))
+    assert len(sentences) == len(paragraphs)
+    assert len(set(sentences)) == len(paragraphs)
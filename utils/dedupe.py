@@ -0,0 +1,168 @@
+from __future__ import annotations
+import itertools
+import re
+import zlib
+from collections import Counter
+from typing import Iterable, Iterator, List, Optional, Set, Tuple
+
+import numpy as np
+
+from utils.text import norm_key
+
+# --------------------------
+# Settings
+# --------------------------
+REPEAT_MIN_PAGES = 3        # documents shorter than this are left alone
+REPEAT_PAGE_FRAC = 0.5      # an edge line on at least this share of pages is boilerplate
+EDGE_LINES = 2              # header / footer candidates: first and last lines of a page
+DEDUPE_SAMPLE_PAGES = 12    # header / footer lines are learned from the first pages
+SHINGLE_WORDS = 5
+MINHASH_PERM = 128
+NEAR_DUP_CONTAINMENT = 0.8  # a page this much contained in a kept page is dropped
+CANDIDATE_SLACK = 0.2       # MinHash estimates this far below the bar are still checked
+MIN_SHINGLES = 8            # shorter pages (titles, "Questions?") are never dropped
+
+# Multiply-shift hash family: h(x) = ((a * x + b) mod 2**64) >> 32, a odd
+_rng = np.random.default_rng(1)
+_A = _rng.integers(0, 2**64, MINHASH_PERM, dtype=np.uint64, endpoint=False) | np.uint64(1)
+_B = _rng.integers(0, 2**64, MINHASH_PERM, dtype=np.uint64, endpoint=False)
+_EMPTY = np.uint64(2**32)
+
+_COUNTER = r"\d+(?:\s*(?:/|of)\s*\d+)?"
+PAGE_COUNTER = re.compile(
+    rf"^(?:(?:page|slide|p\.)\s*)?{_COUNTER}$"           # the whole line is a counter
+    rf"|(?:[|•·–—-]|\bpage\b|\bslide\b)\s*{_COUNTER}$"  # "... | 12", "... page 3 of 9"
+    rf"|^{_COUNTER}\s*[|•·–—-]"                         # "12 | ..."
+)
+
+
+def _line_key(line: str) -> str:
+    # Page counters ("Slide 3 of 40", "... | 12") vary between pages: mask only those digits
+    key = re.sub(r"\s+", " ", line).strip().lower()
+    return PAGE_COUNTER.sub(lambda m: re.sub(r"\d+", "#", m.group()), key)
+
+
+def _edge_lines(lines: List[str]) -> Iterator[Tuple[int, Tuple[str, int, str]]]:
+    """(index, (edge, position, key)) for the first / last EDGE_LINES non-empty lines of a page."""
+    filled = [i for i, line in enumerate(lines) if line.strip()]
+    for pos, i in enumerate(filled[:EDGE_LINES]):
+        yield i, ("top", pos, _line_key(lines[i]))
+    for pos, i in enumerate(reversed(filled[EDGE_LINES:][-EDGE_LINES:])):
+        yield i, ("bottom", pos, _line_key(lines[i]))
+
+
+def repeated_edge_lines(pages: List[str]) -> Set[Tuple[str, int, str]]:
+    """
+    Header / footer lines: the same line at the same edge position (e.g.
+    first line, last line) on at least REPEAT_PAGE_FRAC of the pages.
+    Lines inside a page are never candidates, and strip_edge_lines only
+    removes runs that start at the page edge.
+    """
+    if len(pages) < REPEAT_MIN_PAGES:
+        return set()
+    seen = Counter()
+    for page in pages:
+        seen.update({slot for _, slot in _edge_lines(page.splitlines()) if slot[2]})
+    threshold = max(REPEAT_MIN_PAGES, REPEAT_PAGE_FRAC * len(pages))
+    return {slot for slot, n in seen.items() if n >= threshold}
+
+
+def strip_edge_lines(page: str, boilerplate: Set[Tuple[str, int, str]]) -> Tuple[str, int]:
+    """Remove the boilerplate header / footer lines of one page; returns the page and lines removed."""
+    if not boilerplate:
+        return page, 0
+    lines = page.splitlines()
+    drop = set()
+    # Only runs starting at the page edge: an inner line goes only under a stripped outer one
+    broken = set()
+    for i, slot in _edge_lines(lines):
+        if slot[0] in broken or slot not in boilerplate:
+            broken.add(slot[0])
+        else:
+            drop.add(i)
+    return "\n".join(l for i, l in enumerate(lines) if i not in drop), len(drop)
+
+
+def _shingles(text: str) -> np.ndarray:
+    # Word shingles within each line, so a build-up step is a true subset of its final slide
+    grams = set()
+    for line in text.splitlines():
+        words = norm_key(line).split()
+        grams.update(" ".join(words[i : i + SHINGLE_WORDS]) for i in range(max(1, len(words) - SHINGLE_WORDS + 1)))
+    grams.discard("")
+    return np.fromiter((zlib.crc32(g.encode("utf-8")) for g in grams), dtype=np.uint64, count=len(grams))
+
+
+def minhash(shingles: np.ndarray) -> np.ndarray:
+    """MINHASH_PERM-value signature of a shingle-hash set (all max for an empty set)."""
+    if not len(shingles):
+        return np.full(MINHASH_PERM, _EMPTY, dtype=np.uint64)
+    return ((_A[:, None] * shingles[None, :] + _B[:, None]) >> np.uint64(32)).min(axis=1)
+
+
+class _Page:
+    __slots__ = ("text", "shingles", "sig")
+
+    def __init__(self, text: str):
+        self.text = text
+        self.shingles = _shingles(text)
+        self.sig = minhash(self.shingles)
+
+
+def _contained(page: _Page, others: List[_Page]) -> bool:
+    """Is page almost entirely contained in one of others? (MinHash shortlist, exact check)"""
+    if len(page.shingles) < MIN_SHINGLES or not others:
+        return False
+    size = len(page.shingles)
+    sizes = np.array([len(o.shingles) for o in others], dtype=np.float64)
+    jac = (np.stack([o.sig for o in others]) == page.sig).mean(axis=1)
+    # |A ∩ B| / |A| from the Jaccard estimate and both set sizes
+    estimate = jac * (size + sizes) / ((1 + jac) * size)
+    return any(
+        np.isin(page.shingles, others[c].shingles).mean() >= NEAR_DUP_CONTAINMENT
+        for c in np.flatnonzero(estimate >= NEAR_DUP_CONTAINMENT - CANDIDATE_SLACK)
+    )
+
+
+def dedupe_page_stream(pages: Iterable[str], sample_pages: int = DEDUPE_SAMPLE_PAGES) -> Iterator[str]:
+    """
+    Yield pages as they arrive, minus boilerplate header / footer lines
+    (learned from the first `sample_pages` pages) and minus near-duplicate
+    pages: a page contained in an earlier kept page (repeated slide) is
+    dropped, and each page is held back until the next one shows it was not
+    just a build-up step of it. Reports what was removed at the end.
+    """
+    pages = iter(pages)
+    head = list(itertools.islice(pages, sample_pages))
+    boilerplate = repeated_edge_lines(head)
+    before = after = lines = dropped = 0
+    kept: List[_Page] = []
+    pending: Optional[_Page] = None
+    for raw in itertools.chain(head, pages):
+        before += len(raw)
+        text, n = strip_edge_lines(raw, boilerplate)
+        lines += n
+        page = _Page(text)
+        if _contained(page, kept + ([pending] if pending else [])):
+            dropped += 1
+            continue
+        if pending is not None:
+            if _contained(pending, [page]):
+                dropped += 1
+            else:
+                kept.append(pending)
+                after += len(pending.text)
+                yield pending.text
+        pending = page
+    if pending is not None:
+        after += len(pending.text)
+        yield pending.text
+    removed = before - after
+    if removed:
+        print(f"🧹 Removed {lines} repeated header/footer lines and {dropped} near-duplicate pages: "
+              f"{removed} of {before} chars ({removed / max(before, 1):.0%})")
+
+
+def dedupe_pages(pages: List[str]) -> List[str]:
+    """dedupe_page_stream over an in-memory list of pages."""
+    return list(dedupe_page_stream(pages))
@@ -0,0 +1,111 @@
+from __future__ import annotations
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, Optional
+
+_SQL_VARS = 500  # keys per IN (...) query, well under SQLite's variable limit
+
+
+class DiskCache:
+    """
+    Small content-addressed key -> bytes store in one SQLite file.
+    Least-recently-used entries are evicted once the values exceed max_bytes;
+    with a ttl (seconds), entries older than that are treated as missing
+    and purged on the next write.
+    Safe to share between threads and processes (WAL mode, short transactions).
+    """
+
+    def __init__(self, path: Path, max_bytes: int = 512 * 2**20, ttl: Optional[float] = None):
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                " key TEXT PRIMARY KEY, value BLOB NOT NULL,"
+                " size INTEGER NOT NULL, last_used REAL NOT NULL)"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS entries_lru ON entries(last_used)")
+            # Caches created before TTL support lack the creation time
+            columns = {row[1] for row in db.execute("PRAGMA table_info(entries)")}
+            if "created" not in columns:
+                db.execute("ALTER TABLE entries ADD COLUMN created REAL NOT NULL DEFAULT 0")
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        # One short-lived connection per operation: commit on success, always close
+        db = sqlite3.connect(self.path, timeout=30)
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, bytes]:
+        """Bulk lookup; returns only the keys that were found and marks them used."""
+        keys = list(dict.fromkeys(keys))
+        found: Dict[str, bytes] = {}
+        now = time.time()
+        oldest = now - self.ttl if self.ttl is not None else float("-inf")
+        with self._lock, self._connect() as db:
+            for i in range(0, len(keys), _SQL_VARS):
+                part = keys[i : i + _SQL_VARS]
+                marks = ",".join("?" * len(part))
+                rows = db.execute(
+                    f"SELECT key, value FROM entries WHERE key IN ({marks}) AND created >= ?", part + [oldest]
+                ).fetchall()
+                found.update(rows)
+                if rows:
+                    db.execute(
+                        f"UPDATE entries SET last_used = ? WHERE key IN ({','.join('?' * len(rows))})",
+                        [now] + [k for k, _ in rows],
+                    )
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self.get_many([key]).get(key)
+
+    def put_many(self, items: Dict[str, bytes]) -> None:
+        """Insert or replace entries, then drop expired and LRU entries beyond max_bytes."""
+        if not items:
+            return
+        now = time.time()
+        with self._lock, self._connect() as db:
+            db.executemany(
+                "INSERT OR REPLACE INTO entries (key, value, size, last_used, created) VALUES (?, ?, ?, ?, ?)",
+                [(k, sqlite3.Binary(v), len(v), now, now) for k, v in items.items()],
+            )
+            if self.ttl is not None:
+                db.execute("DELETE FROM entries WHERE created < ?", (now - self.ttl,))
+            db.execute(
+                "DELETE FROM entries WHERE key IN ("
+                " SELECT key FROM (SELECT key, SUM(size) OVER (ORDER BY last_used DESC, key) AS running"
+                " FROM entries) WHERE running > ?)",
+                (self.max_bytes,),
+            )
+
+    def put(self, key: str, value: bytes) -> None:
+        self.put_many({key: value})
+
+    def stats(self) -> Dict[str, float]:
+        """Hit/miss counters for this process plus the current on-disk footprint."""
+        with self._connect() as db:
+            entries, size = db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": entries,
+            "bytes": size,
+        }
@@ -8,8 +8,9 @@ DATA_IN = ROOT / "data" / "input"
 DATA_PROC = ROOT / "data" / "processed"
 SLIDES_OUT = ROOT / "outputs" / "slides"
 RUNS = ROOT / "runs"
+CACHE_DIR = ROOT / "data" / "cache"
 
-for p in [DATA_IN, DATA_PROC, SLIDES_OUT, RUNS]:
+for p in [DATA_IN, DATA_PROC, SLIDES_OUT, RUNS, CACHE_DIR]:
     p.mkdir(parents=True, exist_ok=True)
 
 def ts() -> str:
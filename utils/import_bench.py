@@ -0,0 +1,53 @@
+from __future__ import annotations
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+
+# What the login screen needs vs. what only the pipeline needs
+LOGIN_IMPORTS = ["streamlit", "utils.fs", "utils.auth"]
+PIPELINE_IMPORTS = [
+    "agents.gemini_client",
+    "agents.retriever",
+    "agents.transcript_cleaner",
+    "agents.keypoints_extractor",
+    "agents.slide_generator",
+]
+
+
+def time_import(module: str, repeat: int = 3) -> float:
+    """Best-of-N wall time (ms) to import `module` in a fresh interpreter."""
+    code = f"import time; t = time.perf_counter(); import {module}; print((time.perf_counter() - t) * 1000)"
+    best = float("inf")
+    for _ in range(repeat):
+        out = subprocess.run(
+            [sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True
+        )
+        if out.returncode != 0:
+            raise RuntimeError(f"import {module} failed:\n{out.stderr.strip()}")
+        best = min(best, float(out.stdout.strip().splitlines()[-1]))
+    return best
+
+
+def kb_loaded_on_import() -> bool:
+    """True if importing agents.retriever touches the KB (it must not)."""
+    code = "import agents.retriever as r; print(bool(r._KB_CACHE))"
+    out = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True)
+    return out.stdout.strip().splitlines()[-1:] == ["True"]
+
+
+def main() -> None:
+    print(f"{'module':<32} {'ms':>8}")
+    for group, modules in (("login", LOGIN_IMPORTS), ("pipeline", PIPELINE_IMPORTS)):
+        print(f"-- {group}")
+        for module in modules:
+            try:
+                print(f"{module:<32} {time_import(module):>8.1f}")
+            except RuntimeError as e:
+                print(f"{module:<32} {'n/a':>8}  ({e.args[0].splitlines()[-1]})")
+    print(f"KB loaded at import: {kb_loaded_on_import()}")
+
+
+if __name__ == "__main__":
+    main()
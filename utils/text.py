@@ -8,3 +8,19 @@ def strip_fillers(text: str) -> str:
 
 def squeeze_spaces(text: str) -> str:
     return re.sub(r"\s+", " ", text).strip()
+
+def word_windows(text: str, size: int = 200, overlap: int = 40) -> list[str]:
+    # Overlapping windows of `size` words (the last window may be shorter)
+    words = text.split()
+    step = max(1, size - overlap)
+    return [" ".join(words[i : i + size]) for i in range(0, max(1, len(words) - overlap), step)]
+
+SENTENCE_END = re.compile(r"(?:(?<=[.!?])|(?<=[.!?][\"')\]]))\s+(?=[\"'(\[]?[A-Z0-9])")
+
+def split_sentences(text: str) -> list[str]:
+    # Sentence-ish pieces: split after . ! ? followed by an upper-case / digit start
+    return [s.strip() for s in SENTENCE_END.split(text) if s.strip()]
+
+def norm_key(text: str) -> str:
+    # Lower-case alphanumerics only, for fuzzy duplicate checks
+    return re.sub(r"[^a-z0-9]+", " ", text.lower()).strip()
@@ -0,0 +1,75 @@
+from __future__ import annotations
+import os
+import re
+import statistics
+from typing import Dict
+
+from pydantic import BaseModel
+
+from utils.text import split_sentences, squeeze_spaces
+
+# --------------------------
+# Settings
+# --------------------------
+CLEAN_BYPASS_SCORE = float(os.getenv("CLEAN_BYPASS_SCORE", "0.85"))  # > 1 disables the bypass
+COMPONENT_FLOOR = 0.5   # every signal must pass this, a high average is not enough
+MIN_WORDS = 50          # too little text to judge: always clean
+
+WEIGHTS = {"fillers": 0.35, "punctuation": 0.25, "sentences": 0.2, "casing": 0.2}
+
+# Speech disfluencies; hedges ("like", "kind of") also occur in writing and count half
+DISFLUENCIES = re.compile(r"\b(um+|uh+|erm|er|ah|hmm|you know|i mean)\b", re.IGNORECASE)
+HEDGES = re.compile(r"\b(like|kind of|sort of|basically|so yeah)\b", re.IGNORECASE)
+BLOCKS = re.compile(r"\n\s*\n|\n(?=\s*(?:[-•*▪]|\d+[.)])\s)")
+TERMINATORS = re.compile(r"[.!?](?=\s|$)|^\s*(?:[-•*▪]|\d+[.)])\s", re.MULTILINE)
+FILLERS_PER_WORD_MAX = 0.01   # one filler per 100 words scores 0
+WORDS_PER_TERMINATOR_OK = 30  # looser punctuation than this starts to lose points
+RUN_ON_WORDS = 50             # sentences longer than this count as run-ons
+
+
+class TextQuality(BaseModel):
+    score: float
+    components: Dict[str, float]
+    words: int
+    is_clean: bool
+
+    def describe(self) -> str:
+        parts = ", ".join(f"{k} {v:.2f}" for k, v in self.components.items())
+        return f"quality {self.score:.2f} ({parts})"
+
+
+def _clip(x: float) -> float:
+    return max(0.0, min(1.0, x))
+
+
+def score_text(text: str, threshold: float = CLEAN_BYPASS_SCORE) -> TextQuality:
+    """
+    Local guess at whether text is already written prose / notes rather than
+    a raw speech transcript, from filler density, punctuation ratio,
+    sentence length distribution and casing (each scored 0..1).
+    """
+    words = text.split()
+    n = len(words)
+    if n == 0:
+        return TextQuality(score=0.0, components={}, words=0, is_clean=False)
+
+    fillers = len(DISFLUENCIES.findall(text)) + 0.5 * len(HEDGES.findall(text))
+    terminators = max(1, len(TERMINATORS.findall(text)))
+    # Extracted PDF lines wrap mid-sentence: only blank lines and bullets break sentences
+    sentences = [s for block in BLOCKS.split(text) for s in split_sentences(squeeze_spaces(block))] or [text]
+    lengths = [len(s.split()) for s in sentences]
+    run_ons = sum(length > RUN_ON_WORDS for length in lengths) / len(lengths)
+    starts = sum(s.lstrip("\"'([-•*▪ ")[:1].isupper() or s.lstrip()[:1].isdigit() for s in sentences)
+    letters = [c for c in text if c.isalpha()]
+    upper_share = sum(c.isupper() for c in letters) / max(1, len(letters))
+
+    components = {
+        "fillers": _clip(1 - fillers / n / FILLERS_PER_WORD_MAX),
+        "punctuation": _clip(2 - (n / terminators) / WORDS_PER_TERMINATOR_OK),
+        "sentences": _clip(1 - 2 * run_ons) if statistics.median(lengths) <= RUN_ON_WORDS else 0.0,
+        # Sentence-initial capitals, and not an all-lowercase (or all-caps) dump
+        "casing": _clip(starts / len(sentences)) * (1.0 if 0.01 <= upper_share <= 0.5 else 0.0),
+    }
+    score = sum(WEIGHTS[k] * v for k, v in components.items())
+    is_clean = n >= MIN_WORDS and score >= threshold and min(components.values()) >= COMPONENT_FLOOR
+    return TextQuality(score=round(score, 3), components=components, words=n, is_clean=is_clean)
@@ -0,0 +1,64 @@
+from __future__ import annotations
+import os
+import re
+
+# --------------------------
+# Token counting for prompt budgets
+# --------------------------
+# tiktoken's BPE is a close stand-in for Gemini's tokenizer and runs
+# in-process (no API round-trip). If tiktoken or its encoding file is not
+# available (e.g. offline first run) a word/punctuation estimate is used;
+# it errs on the high side so budgets stay safe.
+TOKENIZER_ENCODING = os.getenv("TOKENIZER_ENCODING", "cl100k_base")
+_PIECE = re.compile(r"\w+|[^\w\s]")
+
+_encoding = None
+_encoding_failed = False
+
+
+def _get_encoding():
+    """The tiktoken encoding, loaded on first use (None if unavailable)."""
+    global _encoding, _encoding_failed
+    if _encoding is None and not _encoding_failed:
+        try:
+            import tiktoken
+
+            _encoding = tiktoken.get_encoding(TOKENIZER_ENCODING)
+        except Exception as e:
+            _encoding_failed = True
+            print(f"⚠️ tiktoken unavailable ({type(e).__name__}); estimating token counts")
+    return _encoding
+
+
+def _piece_cost(piece: str) -> int:
+    # Short words are one token, long ones split every ~6 characters
+    return 1 + (len(piece) - 1) // 6 if piece[0].isalnum() or piece[0] == "_" else 1
+
+
+def count_tokens(text: str) -> int:
+    """Number of tokens in text."""
+    if not text:
+        return 0
+    enc = _get_encoding()
+    if enc is not None:
+        return len(enc.encode(text, disallowed_special=()))
+    return sum(_piece_cost(m.group()) for m in _PIECE.finditer(text))
+
+
+def truncate_tokens(text: str, max_tokens: int) -> str:
+    """Longest prefix of text with at most max_tokens tokens."""
+    if max_tokens <= 0:
+        return ""
+    enc = _get_encoding()
+    if enc is not None:
+        ids = enc.encode(text, disallowed_special=())
+        return text if len(ids) <= max_tokens else enc.decode(ids[:max_tokens])
+    used = 0
+    for m in _PIECE.finditer(text):
+        cost = _piece_cost(m.group())
+        if used + cost > max_tokens:
+            # A long word is cut inside (~6 characters per remaining token)
+            room = (max_tokens - used) * 6 if cost > 1 else 0
+            return text[: m.start() + room].rstrip()
+        used += cost
+    return text